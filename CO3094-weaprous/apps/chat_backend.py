@@ -1,8 +1,15 @@
 import socket
 import threading
-from daemon.httpadapter import HttpAdapter
+from daemon.httpadapter import HttpAdapter, adapter_factory, KEEPALIVE_TIMEOUT
+from daemon.eventloop import serve
+
+def run_chat_backend(ip, port, routes, event_loop=False):
+    if event_loop:
+        print(f"\033[96mChatApp running, click on \033[92mhttp://{ip}:{port}/login\033[0m")
+        serve(ip, port, adapter_factory(ip, port, routes), name="ChatBackend",
+              idle_timeout=KEEPALIVE_TIMEOUT)
+        return
 
-def run_chat_backend(ip, port, routes):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.bind((ip, port))
     s.listen(50)
@@ -0,0 +1,157 @@
+import json
+import threading
+from bisect import bisect_left
+
+MESSAGE_CAPACITY = 2000           # messages kept in memory
+SPILL_INDEX_EVERY = 256           # spill file offset remembered every this many seqs
+
+
+class MessageLog:
+    """Bounded, thread-safe log of chat messages.
+
+    Every message gets the next sequence number (0, 1, 2, ...), which is
+    also the long-poll cursor: reading ``since=n`` returns the messages
+    with seq >= n and ``next`` is the seq the next message will get. The
+    newest ``capacity`` messages live in a fixed ring of slots, so a seq is
+    found in O(1); each peer has a sorted list of its seqs, so "messages
+    with peer X since n" is a bisect instead of a scan.
+
+    With ``spill_path`` the messages pushed out of the ring are appended to
+    that file (JSON lines, truncated on start) and reads reaching back
+    before the ring continue from it, starting at the nearest sparse
+    offset. Without it they are gone.
+
+    Usage::
+      >>> log = MessageLog(capacity=1000)
+      >>> log.append(("127.0.0.1:7002", "hi"), peer="127.0.0.1:7002")
+      0
+      >>> log.read(0, peer="127.0.0.1:7002")
+      ([('127.0.0.1:7002', 'hi')], 1)
+    """
+
+    def __init__(self, capacity=MESSAGE_CAPACITY, spill_path=None):
+        self.capacity = capacity
+        self.slots = [None] * capacity    # seq % capacity -> (seq, peer, entry)
+        self.base = 0                     # oldest seq still in memory
+        self.next_seq = 0
+        self.index = {}                   # peer -> sorted seqs, may start below base
+        self.cond = threading.Condition()
+        self._evicted = 0
+
+        self.spill = None
+        self.spill_path = spill_path
+        self.spill_offsets = []           # offset of seq i * SPILL_INDEX_EVERY
+        if spill_path:
+            self.spill = open(spill_path, "w+b")
+
+    def __len__(self):
+        return self.next_seq - self.base
+
+    def append(self, entry, peer=None):
+        """
+        Add ``entry`` (any JSON-serializable value), filed under ``peer``.
+
+        :rtype: int - Its sequence number.
+        """
+        with self.cond:
+            seq = self.next_seq
+            if seq - self.base >= self.capacity:
+                self._evict()
+            self.slots[seq % self.capacity] = (seq, peer, entry)
+            if peer is not None:
+                self.index.setdefault(peer, []).append(seq)
+            self.next_seq = seq + 1
+            self.cond.notify_all()
+            return seq
+
+    def _evict(self):
+        seq, peer, entry = self.slots[self.base % self.capacity]
+        self.slots[self.base % self.capacity] = None
+        self.base += 1
+        if self.spill is not None:
+            if seq % SPILL_INDEX_EVERY == 0:
+                self.spill.seek(0, 2)
+                self.spill_offsets.append(self.spill.tell())
+            line = json.dumps({"seq": seq, "peer": peer, "entry": entry})
+            self.spill.write(line.encode("utf-8") + b"\n")
+        # drop evicted seqs from the per-peer lists once per ring turn
+        self._evicted += 1
+        if self._evicted >= self.capacity:
+            self._evicted = 0
+            for key in list(self.index):
+                seqs = self.index[key]
+                del seqs[:bisect_left(seqs, self.base)]
+                if not seqs:
+                    del self.index[key]
+
+    def _read_spill(self, since, peer, limit):
+        out = []
+        block = since // SPILL_INDEX_EVERY
+        if self.spill is None or block >= len(self.spill_offsets):
+            return out, since
+        self.spill.flush()
+        self.spill.seek(self.spill_offsets[block])
+        for line in self.spill:
+            rec = json.loads(line)
+            if rec["seq"] < since or (peer is not None and rec["peer"] != peer):
+                continue
+            out.append(rec["entry"])
+            if limit is not None and len(out) >= limit:
+                self.spill.seek(0, 2)
+                return out, rec["seq"] + 1
+        self.spill.seek(0, 2)
+        return out, self.base
+
+    def _read(self, since, peer, limit):
+        if since > self.next_seq:
+            since = 0                     # cursor from before a restart
+        out = []
+        if since < self.base:
+            out, since = self._read_spill(since, peer, limit)
+            if limit is not None:
+                limit -= len(out)
+                if limit <= 0:
+                    return out, since
+            since = max(since, self.base)
+        if peer is None:
+            seqs = range(since, self.next_seq)
+        else:
+            seqs = self.index.get(peer, [])
+            seqs = seqs[bisect_left(seqs, since):]
+        cursor = self.next_seq
+        if limit is not None and len(seqs) > limit:
+            seqs = seqs[:limit]
+            cursor = seqs[-1] + 1
+        out.extend(self.slots[seq % self.capacity][2] for seq in seqs)
+        return out, cursor
+
+    def read(self, since=0, peer=None, limit=None):
+        """
+        Return ``(entries, next)``: the entries from seq ``since`` on (only
+        those filed under ``peer`` if given, at most ``limit``) and the
+        cursor to read from next time.
+        """
+        with self.cond:
+            return self._read(since, peer, limit)
+
+    def wait(self, since, timeout, peer=None):
+        """Like :meth:`read`, but block up to ``timeout`` seconds for a new entry."""
+        with self.cond:
+            if since > self.next_seq:
+                since = 0
+            self.cond.wait_for(
+                lambda: (self.index.get(peer, [-1])[-1] >= since if peer is not None
+                         else self.next_seq > since),
+                timeout)
+            return self._read(since, peer, None)
+
+    def recent(self, peer=None):
+        """Return the entries still in memory, oldest first."""
+        with self.cond:
+            return self._read(self.base, peer, None)[0]
+
+    def close(self):
+        with self.cond:
+            if self.spill is not None:
+                self.spill.close()
+                self.spill = None
@@ -1,17 +1,315 @@
 import socket
+import struct
 import threading
 import json
+import random
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from apps.messagelog import MESSAGE_CAPACITY, MessageLog
+from daemon.eventloop import serve
+from daemon.events import EventBus
+from daemon.pool import is_alive
+
+try:
+    import msgpack
+except ImportError:  # optional compact encoding
+    msgpack = None
+
+# Longest a /get-messages?since= long-poll waits for a new message, in seconds
+LONG_POLL_TIMEOUT = 25
+
+# Peer-to-peer wire format: each packet is a 4-byte big-endian header
+# followed by the encoded packet, on a connection kept open between packets.
+# The header's top byte is the encoding (WIRE_FORMATS) and the low 24 bits
+# the payload length. A connection whose first byte is "{" is the legacy
+# format: one JSON packet, then close.
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1024 * 1024
+WIRE_FORMATS = {"json": 0, "msgpack": 1}
+
+# Queued packets are written together, up to this many bytes per write
+BATCH_MAX_BYTES = 64 * 1024
+
+LINK_CONNECT_TIMEOUT = 3          # seconds to open a link
+LINK_SEND_TIMEOUT = 10            # seconds a blocked write may take
+LINK_QUEUE_SIZE = 1024            # packets waiting per peer before send() fails
+LINK_RETRIES = 5                  # reconnects before queued packets are dropped
+LINK_BACKOFF_MAX = 8              # seconds between reconnect attempts, at most
+
+BROADCAST_WORKERS = 16            # peers a broadcast is handed to concurrently
+BROADCAST_TIMEOUT = 5             # seconds for one peer before it counts as timed out
+BROADCAST_HISTORY = 64            # delivery reports kept for /broadcast-status
+
+# Gossip broadcast: every node forwards a message it sees for the first time
+# to GOSSIP_FANOUT random connected peers, for at most GOSSIP_TTL hops.
+GOSSIP_FANOUT = 4
+GOSSIP_TTL = 8
+GOSSIP_SEEN_SIZE = 4096           # message ids remembered for duplicate suppression
+
+
+def encode_frame(pkt, wire_format="json"):
+    if wire_format == "msgpack" and msgpack is not None:
+        data = msgpack.packb(pkt, use_bin_type=True)
+    else:
+        wire_format = "json"
+        data = json.dumps(pkt, separators=(",", ":")).encode("utf-8")
+    # past MAX_FRAME_SIZE the receiver drops the link, and the length must
+    # never spill over into the encoding byte
+    if len(data) > min(MAX_FRAME_SIZE, 0xFFFFFF):
+        raise FrameError("frame too large: {}".format(len(data)))
+    return FRAME_HEADER.pack(WIRE_FORMATS[wire_format] << 24 | len(data)) + data
+
+
+def decode_payload(kind, data):
+    if kind == WIRE_FORMATS["json"]:
+        return json.loads(data)
+    if kind == WIRE_FORMATS["msgpack"] and msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    raise ValueError("unsupported encoding {}".format(kind))
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameReader:
+    """Incremental decoder of length-prefixed packets.
+
+    Bytes are appended with :meth:`feed`; :meth:`packets` yields every
+    complete packet and keeps a trailing partial one for the next call.
+    """
+
+    def __init__(self, max_frame=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame = max_frame
+
+    def feed(self, data):
+        self.buffer += data
+
+    def packets(self):
+        buf = self.buffer
+        pos = 0
+        while len(buf) - pos >= FRAME_HEADER.size:
+            (header,) = FRAME_HEADER.unpack_from(buf, pos)
+            kind, length = header >> 24, header & 0xFFFFFF
+            if length > self.max_frame:
+                raise FrameError("frame too large: {}".format(length))
+            end = pos + FRAME_HEADER.size + length
+            if len(buf) < end:
+                break
+            data = bytes(buf[pos + FRAME_HEADER.size:end])
+            pos = end
+            try:
+                yield decode_payload(kind, data)
+            except ValueError as e:
+                print("[PeerNode] Dropped undecodable packet:", e)
+        del buf[:pos]
+
+
+class SeenSet:
+    """Bounded set of recently seen message ids, oldest forgotten first."""
+
+    def __init__(self, size=GOSSIP_SEEN_SIZE):
+        self.size = size
+        self.ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, msg_id):
+        """
+        Remember ``msg_id``.
+
+        :rtype: bool - ``True`` if it was not seen before.
+        """
+        with self._lock:
+            if msg_id in self.ids:
+                return False
+            self.ids[msg_id] = None
+            if len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+            return True
+
+
+class PeerLink:
+    """Persistent outbound connection to one peer.
+
+    Packets are queued by :meth:`send` and written by a dedicated thread in
+    order; whatever has queued up meanwhile goes out in one write (up to
+    ``BATCH_MAX_BYTES``). A broken connection is reopened with exponential
+    backoff and the batch that failed is retried, so a peer restart loses
+    nothing that was still queued.
+    """
+
+    def __init__(self, ip, port, queue_size=LINK_QUEUE_SIZE, wire_format="json"):
+        self.ip = ip
+        self.port = port
+        self.queue_size = queue_size
+        self.wire_format = wire_format
+        self.sock = None
+        self.queue = deque()
+        self.closed = False
+        self._cond = threading.Condition()
+        self._sock_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _connect(self):
+        with self._sock_lock:
+            if self.sock is not None:
+                return self.sock
+            sock = socket.create_connection((self.ip, self.port), timeout=LINK_CONNECT_TIMEOUT)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(LINK_SEND_TIMEOUT)
+            self.sock = sock
+            return sock
+
+    def _drop(self):
+        with self._sock_lock:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def send(self, pkt, callback=None):
+        """
+        Queue ``pkt`` for the peer. ``callback``, if given, is called from
+        the writer thread with ``True`` once the packet was written to the
+        connection or ``False`` if it was dropped.
+
+        :rtype: bool - ``False`` if the packet is larger than
+            ``MAX_FRAME_SIZE``, the peer cannot be reached or too many
+            packets are already waiting.
+        """
+        try:
+            frame = encode_frame(pkt, self.wire_format)
+        except FrameError as e:
+            print("[PeerNode] Not sent to {}:{}: {}".format(self.ip, self.port, e))
+            return False
+        if self.sock is None:
+            try:
+                self._connect()
+            except OSError:
+                return False
+        with self._cond:
+            if self.closed or len(self.queue) >= self.queue_size:
+                return False
+            self.queue.append((frame, callback))
+            self._cond.notify()
+        return True
+
+    @staticmethod
+    def _notify(items, ok):
+        for _, callback in items:
+            if callback is not None:
+                try:
+                    callback(ok)
+                except Exception as e:
+                    print("[PeerNode] Delivery callback failed:", e)
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                while not self.queue and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    break
+                batch = []
+                size = 0
+                for item in self.queue:
+                    if batch and size + len(item[0]) > BATCH_MAX_BYTES:
+                        break
+                    batch.append(item)
+                    size += len(item[0])
+            try:
+                sock = self.sock
+                # the peer never writes on this connection, so anything
+                # readable means it closed: reconnect before writing
+                if sock is not None and not is_alive(sock):
+                    self._drop()
+                    sock = None
+                (sock or self._connect()).sendall(b"".join(frame for frame, _ in batch))
+            except OSError:
+                self._drop()
+                failures += 1
+                if failures > LINK_RETRIES:
+                    with self._cond:
+                        dropped = list(self.queue)
+                        self.queue.clear()
+                    print("[PeerNode] {}:{} unreachable, dropped {} packet(s)".format(
+                        self.ip, self.port, len(dropped)))
+                    self._notify(dropped, False)
+                    failures = 0
+                    continue
+                time.sleep(min(LINK_BACKOFF_MAX, 0.25 * 2 ** failures))
+                continue
+            failures = 0
+            with self._cond:
+                # only this thread removes packets, unless the link was
+                # cleared after too many failures
+                if self.queue and self.queue[0] is batch[0]:
+                    for _ in batch:
+                        self.queue.popleft()
+            self._notify(batch, True)
+        with self._cond:
+            dropped = list(self.queue)
+            self.queue.clear()
+        self._notify(dropped, False)
+        self._drop()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
 
 class PeerNode:
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, wire_format="json", broadcast_mode="direct",
+                 fanout=GOSSIP_FANOUT, gossip_ttl=GOSSIP_TTL,
+                 message_capacity=MESSAGE_CAPACITY, spill_path=None):
         self.ip = ip
         self.port = port
+        if wire_format == "msgpack" and msgpack is None:
+            print("[PeerNode] msgpack is not installed, sending JSON")
+            wire_format = "json"
+        self.wire_format = wire_format
+
+        # "direct": a broadcast goes to every connected peer; "gossip": to
+        # ``fanout`` of them, and every receiver relays it the same way
+        self.broadcast_mode = broadcast_mode
+        self.fanout = fanout
+        self.gossip_ttl = gossip_ttl
+        self.seen = SeenSet()
 
         self.connected_peers = {}        # peer_id → (ip, port, socket)
         self.pending_requests = []       # list of (ip,port)
-        self.messages = []               # store messages for UI
+        # messages for the UI, filed by peer id ("BROADCAST" for broadcasts)
+        self.messages = MessageLog(message_capacity, spill_path)
+
+        # pushed to the UI over /events: "message", "pending", "connected"
+        self.events = EventBus()
+
+        self.links = {}                  # (ip, port) → PeerLink
+        self._links_lock = threading.Lock()
+
+        # broadcast fan-out and its delivery reports, newest last
+        self.broadcast_pool = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS,
+                                                 thread_name_prefix="broadcast")
+        self.broadcasts = OrderedDict()  # broadcast id → report
+        self._broadcast_ids = 0
+        self._broadcast_lock = threading.Lock()
+
+    def run(self, event_loop=False):
+        if event_loop:
+            def factory(conn, addr):
+                reader = FrameReader()
+                return lambda: self.handle_conn(conn, addr, reader, evented=True)
+            serve(self.ip, self.port, factory, name="PeerNode")
+            return
 
-    def run(self):
         print(f"[PeerNode] Listening on {self.ip}:{self.port}")
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.bind((self.ip, self.port))
@@ -19,56 +317,112 @@ class PeerNode:
 
         while True:
             conn, addr = s.accept()
-            threading.Thread(target=self.handle_conn, args=(conn, addr)).start()
+            threading.Thread(target=self.handle_conn, args=(conn, addr), daemon=True).start()
 
-    def handle_conn(self, conn, addr):
-        raw = conn.recv(4096).decode()
-        if not raw:
-            return
+    def add_message(self, entry, peer=None):
+        self.messages.append(entry, peer)
+        self.events.publish("message", entry)
 
-        try:
-            data = json.loads(raw)
-        except:
-            return
+    def wait_messages(self, since, timeout=LONG_POLL_TIMEOUT, peer=None):
+        """
+        Return ``(messages, next)``: the messages from sequence number
+        ``since`` on (only those with ``peer`` if given) and the cursor to
+        pass next time. Blocks up to ``timeout`` seconds while there is none.
+        """
+        return self.messages.wait(since, timeout, peer)
+
+    def pending_changed(self):
+        self.events.publish("pending", list(self.pending_requests))
+
+    def connected_list(self):
+        return [{"id": peer_id, "host": val[0], "port": val[1]}
+                for peer_id, val in list(self.connected_peers.items()) if val]
+
+    def connected_changed(self):
+        self.events.publish("connected", {"status": "ok", "peers": self.connected_list()})
 
+    def handle_conn(self, conn, addr, reader=None, evented=False):
+        """
+        Read packets from a peer connection. Threaded, this loops until the
+        peer closes; evented, it handles what is readable now and returns
+        ``True`` to keep the connection in the event loop.
+        """
+        reader = reader or FrameReader()
+        while True:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                conn.close()
+                return False
+
+            if not reader.buffer and data[:1] == b"{":
+                # legacy sender: a single JSON packet per connection
+                try:
+                    self.handle_packet(json.loads(data.decode()))
+                except ValueError:
+                    pass
+                conn.close()
+                return False
+
+            reader.feed(data)
+            try:
+                for pkt in reader.packets():
+                    self.handle_packet(pkt)
+            except FrameError as e:
+                print("[PeerNode] Closing {}: {}".format(addr, e))
+                conn.close()
+                return False
+            if evented:
+                return True
+
+    def handle_packet(self, data):
+        if not isinstance(data, dict):
+            return
         action = data.get("action")
 
         if action == "connect-request":
             self.pending_requests.append(data)
+            self.pending_changed()
             print("[PeerNode] Incoming connect request from", data["from"])
 
         elif action == "connect-accept":
             peer_id = data["from"]
             host = data["host"]
             port = data["port"]
-            self.connected_peers[peer_id] = (host, port, None)
+            self.connected_peers[peer_id] = (host, port, self.link(host, port))
+            self.connected_changed()
             print("[PeerNode] Connection accepted by", peer_id)
 
         elif action == "message":
             msg = data["message"]
-            self.messages.append((data["from"], msg))
+            self.add_message((data["from"], msg), data["from"])
             print("[PeerNode] New P2P message:", msg)
 
         elif action == "broadcast":
             msg = data["message"]
             sender = data.get("from", "unknown")
-            self.messages.append(("BROADCAST", sender, msg))
+            self.add_message(("BROADCAST", sender, msg), "BROADCAST")
             print("[PeerNode] Broadcast received from", sender, ":", msg)
 
+        elif action == "gossip":
+            if not self.seen.add(data.get("id")):
+                return
+            msg = data["message"]
+            sender = data.get("from", "unknown")
+            self.add_message(("BROADCAST", sender, msg), "BROADCAST")
+            print("[PeerNode] Gossip received from", sender, ":", msg)
+            self._relay(data)
+
     def request_connect(self, target_ip, target_port, my_id):
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((target_ip, target_port))
-            pkt = {
-                "action": "connect-request",
-                "from": my_id,
-                "host": self.ip,
-                "port": self.port
-            }
-            s.sendall(json.dumps(pkt).encode())
-            s.close()
-        except:
-            pass
+        pkt = {
+            "action": "connect-request",
+            "from": my_id,
+            "host": self.ip,
+            "port": self.port
+        }
+        return self._send(target_ip, target_port, pkt)
 
     def accept_request(self, req, my_id):
         host = req["host"]
@@ -76,25 +430,21 @@ class PeerNode:
 
         peer_id = req["from"]  # correct unique id
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((host, port))
-            pkt = {
-                "action": "connect-accept",
-                "from": my_id,
-                "host": self.ip,
-                "port": self.port
-            }
-            s.sendall(json.dumps(pkt).encode())
-            s.close()
-            self.connected_peers[peer_id] = (host, port, None)
-            return True
-        except:
+        pkt = {
+            "action": "connect-accept",
+            "from": my_id,
+            "host": self.ip,
+            "port": self.port
+        }
+        if not self._send(host, port, pkt):
             return False
+        self.connected_peers[peer_id] = (host, port, self.link(host, port))
+        self.connected_changed()
+        return True
 
     def send_message(self, target_ip, target_port, my_id, msg):
         try:
-            self.messages.append((my_id, msg))
+            self.add_message((my_id, msg), "{}:{}".format(target_ip, target_port))
         except Exception:
             pass
 
@@ -105,33 +455,153 @@ class PeerNode:
         }
         return self._send(target_ip, target_port, pkt)
 
-    def broadcast(self, my_id, msg):
+    def broadcast(self, my_id, msg, timeout=BROADCAST_TIMEOUT):
+        """
+        Send ``msg`` to every connected peer without waiting for them. In
+        gossip mode only ``fanout`` random peers get it from here; they and
+        every peer after them relay it, skipping ids already seen.
+
+        Peers are handed to ``broadcast_pool`` concurrently, so one that is
+        slow to connect holds up nobody else. Each one ends up "delivered"
+        (written to its connection), "failed", or "timeout" after
+        ``timeout`` seconds, in the report returned by
+        :meth:`broadcast_status`; the finished report is also published as a
+        "broadcast" event.
+
+        :rtype: int - The broadcast id.
+        """
         try:
-            self.messages.append(("BROADCAST", my_id, msg))
+            self.add_message(("BROADCAST", my_id, msg), "BROADCAST")
         except Exception:
             pass
 
+        pkt = {
+            "action": "broadcast",
+            "message": msg,
+            "from": my_id
+        }
+        targets = self._peer_addresses()
+        if self.broadcast_mode == "gossip":
+            pkt["action"] = "gossip"
+            pkt["id"] = "{}/{}".format(my_id, uuid.uuid4().hex)
+            pkt["ttl"] = self.gossip_ttl
+            self.seen.add(pkt["id"])
+            targets = self._gossip_targets(targets)
+
+        with self._broadcast_lock:
+            self._broadcast_ids += 1
+            report = {
+                "id": self._broadcast_ids,
+                "message": msg,
+                "peers": {peer_id: "pending" for peer_id in targets},
+                "done": False,
+            }
+            self.broadcasts[report["id"]] = report
+            while len(self.broadcasts) > BROADCAST_HISTORY:
+                self.broadcasts.popitem(last=False)
+
+        if not targets:
+            self._broadcast_result(report, None, None)
+        for peer_id, (ip, port) in targets.items():
+            self.broadcast_pool.submit(self._broadcast_one, report, peer_id, ip, port, pkt, timeout)
+        return report["id"]
+
+    def _peer_addresses(self, exclude=()):
         # connected_peers items() -> (peer_id, (ip,port,...))
-        for peer_id, val in self.connected_peers.items():
+        targets = {}
+        for peer_id, val in list(self.connected_peers.items()):
+            if peer_id in exclude:
+                continue
             try:
-                ip = val[0]
-                port = val[1]
+                targets[peer_id] = (val[0], val[1])
             except Exception:
                 continue
-            pkt = {
-                "action": "broadcast",
-                "message": msg,
-                "from": my_id
-            }
-            self._send(ip, port, pkt)
+        return targets
+
+    def _gossip_targets(self, targets):
+        if len(targets) <= self.fanout:
+            return targets
+        return dict(random.sample(list(targets.items()), self.fanout))
+
+    def _relay(self, pkt):
+        """Forward a first-seen gossip packet to ``fanout`` other peers."""
+        ttl = int(pkt.get("ttl", 0)) - 1
+        if ttl <= 0:
+            return
+        my_id = "{}:{}".format(self.ip, self.port)
+        exclude = (pkt.get("from"), pkt.get("relay"))
+        pkt = dict(pkt, ttl=ttl, relay=my_id)
+        for ip, port in self._gossip_targets(self._peer_addresses(exclude)).values():
+            # off the receiving thread: opening a link may block
+            self.broadcast_pool.submit(self._send, ip, port, pkt)
+
+    def _broadcast_one(self, report, peer_id, ip, port, pkt, timeout):
+        deadline = time.monotonic() + timeout
+        written = threading.Event()
+        outcome = []
+        def delivered(ok):
+            outcome.append(ok)
+            written.set()
+        try:
+            queued = self.link(ip, port).send(pkt, delivered)
+        except (TypeError, ValueError):
+            queued = False
+        if not queued:
+            status = "failed"
+        elif not written.wait(max(0, deadline - time.monotonic())):
+            status = "timeout"
+        else:
+            status = "delivered" if outcome[0] else "failed"
+        self._broadcast_result(report, peer_id, status)
+
+    def _broadcast_result(self, report, peer_id, status):
+        with self._broadcast_lock:
+            if peer_id is not None:
+                report["peers"][peer_id] = status
+            if report["done"] or "pending" in report["peers"].values():
+                return
+            report["done"] = True
+            snapshot = dict(report, peers=dict(report["peers"]))
+        failed = [p for p, st in snapshot["peers"].items() if st != "delivered"]
+        if failed:
+            print("[PeerNode] Broadcast {} not delivered to {}".format(
+                snapshot["id"], ", ".join(failed)))
+        self.events.publish("broadcast", snapshot)
+
+    def broadcast_status(self, broadcast_id=None):
+        """
+        Return a copy of the delivery report of ``broadcast_id`` (the latest
+        broadcast if ``None``), or ``None`` if it is unknown or too old.
+        """
+        with self._broadcast_lock:
+            if broadcast_id is None:
+                if not self.broadcasts:
+                    return None
+                broadcast_id = next(reversed(self.broadcasts))
+            report = self.broadcasts.get(broadcast_id)
+            return dict(report, peers=dict(report["peers"])) if report else None
+
+    def link(self, ip, port):
+        """Return the persistent :class:`PeerLink` to ``(ip, port)``."""
+        key = (ip, int(port))
+        with self._links_lock:
+            link = self.links.get(key)
+            if link is None:
+                link = PeerLink(ip, int(port), wire_format=self.wire_format)
+                self.links[key] = link
+            return link
+
+    def close_link(self, ip, port):
+        with self._links_lock:
+            link = self.links.pop((ip, int(port)), None)
+        if link is not None:
+            link.close()
 
     def _send(self, ip, port, pkt):
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((ip, port))
-            s.sendall(json.dumps(pkt).encode())
-            s.close()
-            return True
-        except:
+            ok = self.link(ip, port).send(pkt)
+        except (TypeError, ValueError):
+            ok = False
+        if not ok:
             print("[PeerNode] Send failed")
-            return False
+        return ok
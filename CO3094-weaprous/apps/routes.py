@@ -1,6 +1,10 @@
 import json
 import socket
 import os
+import threading
+
+from daemon.events import EventStream, LongPoll
+from apps.peer import LONG_POLL_TIMEOUT
 
 TRACKER_IP = os.environ.get("TRACKER_IP", "127.0.0.1")
 TRACKER_PORT = int(os.environ.get("TRACKER_PORT", "9000"))
@@ -79,6 +83,7 @@ class ChatRoutes:
             ok = self.peer.accept_request(req, my_id)
             peer_from = req.get("from")
             self.peer.pending_requests = [p for p in self.peer.pending_requests if str(p.get("from")) != str(peer_from)]
+            self.peer.pending_changed()
             return {"status":"accepted" if ok else "failed"}
         
         @self.app.route("/deny-request", methods=["POST"])
@@ -86,6 +91,7 @@ class ChatRoutes:
             req = json.loads(body)
             peer_from = req.get("from")
             self.peer.pending_requests = [p for p in self.peer.pending_requests if str(p.get("from")) != str(peer_from)]
+            self.peer.pending_changed()
             return {"status":"denied"}
         
         @self.app.route("/disconnect-peer", methods=["POST"])
@@ -96,10 +102,10 @@ class ChatRoutes:
             port = info.get("port")
             # remove by id if available
             if peer_id and peer_id in self.peer.connected_peers:
-                try:
-                    del self.peer.connected_peers[peer_id]
-                except KeyError:
-                    pass
+                val = self.peer.connected_peers.pop(peer_id, None)
+                if val:
+                    self.peer.close_link(val[0], val[1])
+                self.peer.connected_changed()
                 return {"status":"disconnected"}
             # fallback: find matching ip/port
             to_remove = []
@@ -114,6 +120,9 @@ class ChatRoutes:
                     continue
             for pid in to_remove:
                 self.peer.connected_peers.pop(pid, None)
+                self.peer.close_link(ip, port)
+            if to_remove:
+                self.peer.connected_changed()
             return {"status":"disconnected" if to_remove else "not-found"}
 
         @self.app.route("/send-peer", methods=["POST"])
@@ -131,8 +140,20 @@ class ChatRoutes:
             info = json.loads(body)
             msg = info["message"]
             my_id = f"{self.peer.ip}:{self.peer.port}"
-            self.peer.broadcast(my_id, msg)
-            return {"status":"broadcasted"}
+            broadcast_id = self.peer.broadcast(my_id, msg)
+            return {"status":"broadcasted", "id": broadcast_id}
+
+        @self.app.route("/broadcast-status", methods=["GET"])
+        def broadcast_status(headers, body, query=None):
+            """
+            Delivery report of broadcast ``?id=`` (default: the latest one).
+            """
+            try:
+                broadcast_id = int((query or {}).get("id", ""))
+            except ValueError:
+                broadcast_id = None
+            report = self.peer.broadcast_status(broadcast_id)
+            return report or {"status": "unknown"}
 
         @self.app.route("/get-pending", methods=["GET"])
         def get_pending(headers="guest", body=""):
@@ -178,5 +199,73 @@ class ChatRoutes:
             return {"status": "ok", "peers": peers}
 
         @self.app.route("/get-messages", methods=["GET"])
-        def get_messages(headers="guest", body=""):
-            return self.peer.messages
\ No newline at end of file
+        def get_messages(headers="guest", body="", query=None):
+            """
+            Without a cursor, return the messages kept in memory. With
+            ``?since=<n>`` (sequence number to start from), long-poll: wait
+            until a message arrives or ``timeout`` (default
+            LONG_POLL_TIMEOUT) seconds pass, then return
+            {"messages": [...], "next": <cursor>}. ``?peer=<ip:port>``
+            (or ``BROADCAST``) limits it to one conversation.
+            """
+            query = query or {}
+            if "since" not in query:
+                return self.peer.messages.recent(query.get("peer"))
+            try:
+                since = max(0, int(query["since"]))
+                timeout = min(float(query.get("timeout", LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+            except ValueError:
+                return {"error": "bad since/timeout"}
+            peer = query.get("peer")
+            messages, cursor = self.peer.messages.read(since, peer)
+            if messages:
+                return {"messages": messages, "next": cursor}
+
+            def wait():
+                # off the event-loop workers, see LongPoll
+                messages, cursor = self.peer.wait_messages(since, timeout, peer)
+                return {"messages": messages, "next": cursor}
+            return LongPoll(wait)
+
+        @self.app.route("/events", methods=["GET"])
+        def events(headers="guest", body=""):
+            # text/event-stream of "message", "pending" and "connected"
+            last_id = headers.get("last-event-id") if isinstance(headers, dict) else None
+            return EventStream(self.peer.events, last_id)
+
+        @self.app.websocket("/ws")
+        def chat_ws(ws, headers):
+            """
+            One full-duplex connection per UI tab. Pushes the /events stream
+            as {"event", "id", "data"} and runs commands sent as
+            {"action": "<POST route>", ...}, e.g. {"action": "send-peer",
+            "ip": ..., "port": ..., "message": ...}, answered with
+            {"reply": action, "ref": ..., "result": ...}.
+            """
+            sub = self.peer.events.subscribe()
+
+            def push():
+                while not ws.closed and not sub.dropped:
+                    ev = sub.get(timeout=1)
+                    if ev is not None and not ws.send({"event": ev.event, "id": ev.id, "data": ev.data}):
+                        break
+                # a client too slow to keep up reconnects and resyncs
+                ws.close()
+
+            threading.Thread(target=push, daemon=True).start()
+            try:
+                for raw in iter(ws.receive, None):
+                    try:
+                        cmd = json.loads(raw)
+                        action = cmd.pop("action")
+                        ref = cmd.pop("ref", None)
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue
+                    hook = self.app.routes.get(("POST", "/" + str(action)))
+                    try:
+                        result = hook(headers, json.dumps(cmd)) if hook else {"error": "unknown action"}
+                    except Exception as e:
+                        result = {"error": "hook error", "detail": str(e)}
+                    ws.send({"reply": action, "ref": ref, "result": result})
+            finally:
+                self.peer.events.unsubscribe(sub)
\ No newline at end of file
@@ -1,88 +1,155 @@
 import socket
 import threading
 import json
-import os
-from .httpadapter import HttpAdapter
-
-DB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "db")
-PEERS_FILE = os.path.join(DB_DIR, "peers.json")
-CHANNEL_FILE = os.path.join(DB_DIR, "channels.json")
-
-def load_json(path, default):
-    if not os.path.exists(DB_DIR):
-        os.makedirs(DB_DIR)
-    if not os.path.exists(path):
-        with open(path, "w") as f:
-            json.dump(default, f)
-        return default
-    try:
-        with open(path) as f:
-            return json.load(f)
-    except:
-        return default
-
-def save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f)
+from .httpadapter import HttpAdapter, adapter_factory, KEEPALIVE_TIMEOUT
+from .eventloop import serve
+from .events import EventBus, EventStream
+from .router import Router
+
+from .store import (open_store, load_json, save_json,
+                    DB_DIR, PEERS_FILE, CHANNEL_FILE)
+from .liveness import LeaseTable, PeerScanner, LEASE_TTL
+
+# Tracker storage engine, chosen by create_backend(store=...)
+STORE = None
+
+# Peer liveness tracking over STORE's peers: "lease" (heartbeats) or
+# "probe" (background scanner), chosen by create_backend(liveness=...)
+LIVENESS = "lease"
+TRACKER = None
+_TRACKER_LOCK = threading.Lock()
+
+# Server-sent events of the tracker: "peers" (online peers changed),
+# "channels" (channel created) and "channel" (message posted)
+EVENTS = EventBus()
+
+def get_store():
+    global STORE
+    if STORE is None:
+        STORE = open_store("log")
+    return STORE
+
+def use_store(kind="log", **options):
+    """Select the tracker storage engine (see :func:`daemon.store.open_store`)."""
+    global STORE, TRACKER
+    if TRACKER is not None:
+        TRACKER.stop()
+        TRACKER = None
+    if STORE is not None:
+        STORE.close()
+    STORE = open_store(kind, **options)
+    return STORE
+
+def get_tracker():
+    global TRACKER
+    if TRACKER is None:
+        with _TRACKER_LOCK:
+            if TRACKER is not None:
+                return TRACKER
+            store = get_store()
+            # published before start(): the first probe scan may already
+            # expire peers, and _peers_expired reads them back through here
+            if LIVENESS == "probe":
+                TRACKER = PeerScanner(store, on_expire=_peers_expired)
+                TRACKER.start()
+            else:
+                TRACKER = LeaseTable(LEASE_TTL, on_expire=_peers_expired)
+                TRACKER.start(store.list_peers())
+    return TRACKER
+
+def _peers_expired(peers):
+    get_store().remove_peers(peers)
+    EVENTS.publish("peers", list_peers())
+
+def use_liveness(kind="lease"):
+    """Select how the tracker decides which peers are online."""
+    global LIVENESS, TRACKER
+    if kind not in ("lease", "probe"):
+        raise ValueError("unknown liveness mode: {}".format(kind))
+    if TRACKER is not None:
+        TRACKER.stop()
+        TRACKER = None
+    LIVENESS = kind
 
 def register_peer(ip, port):
-    data = load_json(PEERS_FILE, [])
-    for p in data:
-        if p["ip"] == ip and p["port"] == port:
-            return
-    data.append({"ip": ip, "port": port})
-    save_json(PEERS_FILE, data)
+    get_store().register_peer(ip, port)
+    if get_tracker().mark_alive(ip, port):
+        EVENTS.publish("peers", list_peers())
+
+def heartbeat(ip, port):
+    """Renew the lease of a peer, registering it again if it had expired."""
+    if get_tracker().mark_alive(ip, port):
+        get_store().register_peer(ip, port)
+        EVENTS.publish("peers", list_peers())
 
 def list_peers():
-    peers = load_json(PEERS_FILE, [])
-    alive = []
-
-    for p in peers:
-        ip = p.get("ip")
-        port = p.get("port")
-        
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(0.5)
-        try:
-            s.connect((ip, port))
-            alive.append(p)
-        except:
-            pass
-        finally:
-            s.close()
-
-    save_json(PEERS_FILE, alive)
-    return alive
+    # served from the in-memory live set; no probing on the request path
+    return get_tracker().peers()
 
 def create_channel(name):
-    data = load_json(CHANNEL_FILE, {})
-    if name not in data:
-        data[name] = []
-        save_json(CHANNEL_FILE, data)
+    get_store().create_channel(name)
+    EVENTS.publish("channels", {"name": name})
 
 def list_channels():
-    return load_json(CHANNEL_FILE, {})
+    return get_store().list_channels()
 
 def post_channel(name, sender, msg):
-    data = load_json(CHANNEL_FILE, {})
-    if name not in data:
-        data[name] = []
-    data[name].append({"sender": sender, "msg": msg})
-    save_json(CHANNEL_FILE, data)
-
-def read_channel(name):
-    data = load_json(CHANNEL_FILE, {})
-    return data.get(name, [])
+    msg_id = get_store().post_channel(name, sender, msg)
+    EVENTS.publish("channel", {"name": name, "id": msg_id, "sender": sender, "msg": msg})
+    return msg_id
+
+def read_channel(name, since=None, before=None, limit=None):
+    """
+    Return messages of channel ``name``, oldest first, each with its ``id``.
+
+    :param since (int): Only messages with ``id > since``.
+    :param before (int): Only messages with ``id < before``.
+    :param limit (int): At most this many. Without ``since`` the newest
+        ``limit`` are returned, so ``before`` + ``limit`` pages backwards.
+    """
+    store = get_store()
+    start = 0 if since is None else since + 1
+    end = before
+    if limit is not None and since is None:
+        if end is None:
+            end = store.channel_length(name)
+        start = max(start, end - limit)
+    count = None if end is None else max(0, end - start)
+    if limit is not None:
+        count = limit if count is None else min(count, limit)
+    if count == 0:
+        return []
+    msgs = store.read_channel(name, start, count)
+    if end is not None:
+        msgs = [m for m in msgs if m["id"] < end]
+    return msgs
+
+def _int_param(info, key):
+    value = info.get(key)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-def process_backend_routes(method, path, body):
+def process_backend_routes(method, path, body, headers=None):
     if path == "/submit-info" and method == "POST":
         info = json.loads(body)
         register_peer(info["ip"], info["port"])
         return {"status": "ok"}
 
+    if path == "/heartbeat" and method == "POST":
+        info = json.loads(body)
+        heartbeat(info["ip"], info["port"])
+        return {"status": "ok", "ttl": LEASE_TTL}
+
     if path == "/get-list" and method == "GET":
         return list_peers()
 
+    if path == "/events" and method == "GET":
+        return EventStream(EVENTS, (headers or {}).get("last-event-id"))
+
     if path == "/create-channel" and method == "POST":
         info = json.loads(body)
         create_channel(info["name"])
@@ -93,91 +160,92 @@ def process_backend_routes(method, path, body):
 
     if path == "/post-channel" and method == "POST":
         info = json.loads(body)
-        post_channel(info["name"], info["sender"], info["msg"])
-        return {"status": "ok"}
+        msg_id = post_channel(info["name"], info["sender"], info["msg"])
+        return {"status": "ok", "id": msg_id}
 
     if path == "/channel-history" and method == "POST":
         info = json.loads(body)
-        return read_channel(info["name"])
+        limit = _int_param(info, "limit")
+        return read_channel(info["name"],
+                            since=_int_param(info, "since"),
+                            before=_int_param(info, "before"),
+                            limit=None if limit is None else max(0, limit))
 
     return None
 
-def handle_backend(ip, port, conn, addr):
-    try:
-        raw = conn.recv(8192).decode(errors="ignore")
-    except:
-        conn.close()
+TRACKER_ROUTES = [
+    ("POST", "/submit-info"),
+    ("POST", "/heartbeat"),
+    ("GET", "/get-list"),
+    ("GET", "/events"),
+    ("POST", "/create-channel"),
+    ("GET", "/channels"),
+    ("POST", "/post-channel"),
+    ("POST", "/channel-history"),
+]
+
+def _tracker_hook(method, path):
+    def hook(headers=None, body=""):
+        return process_backend_routes(method, path, body, headers)
+    return hook
+
+def channel_history(name, headers=None, body="", query=None):
+    """
+    GET /channels/<name>/history?since=&before=&limit=, the REST form of
+    POST /channel-history.
+    """
+    query = query or {}
+    limit = _int_param(query, "limit")
+    return read_channel(name,
+                        since=_int_param(query, "since"),
+                        before=_int_param(query, "before"),
+                        limit=None if limit is None else max(0, limit))
+
+#: Tracker endpoints with path parameters, served alongside TRACKER_ROUTES.
+TRACKER_PATTERN_ROUTES = {
+    ("GET", "/channels/<name>/history"): channel_history,
+}
+
+def backend_routes(routes=None):
+    """
+    Merge the tracker endpoints with application routes so both are served
+    by the same :class:`HttpAdapter` request loop (keep-alive, pipelining).
+    A route table that already went through here is returned as it is.
+    """
+    if isinstance(routes, Router) and getattr(routes, "tracker", False):
+        return routes
+    merged = Router({key: _tracker_hook(*key) for key in TRACKER_ROUTES})
+    merged.update(TRACKER_PATTERN_ROUTES)
+    if routes:
+        merged.update(routes)
+    merged.tracker = True
+    return merged
+
+def handle_backend(ip, port, conn, addr, routes=None):
+    routes = backend_routes(routes)
+    HttpAdapter(ip, port, conn, addr, routes).handle_client(conn, addr, routes)
+
+def run_backend(ip, port, routes=None, event_loop=False):
+    if event_loop:
+        serve(ip, port, adapter_factory(ip, port, backend_routes(routes)), name="Backend",
+              idle_timeout=KEEPALIVE_TIMEOUT)
         return
 
-    if not raw:
-        conn.close()
-        return
-
-    # parse request line and headers
-    try:
-        lines = raw.splitlines()
-        first = lines[0]
-        method, path, _ = first.split()
-    except:
-        conn.close()
-        return
-
-    # extract Origin header if present
-    origin = None
-    for ln in lines[1:]:
-        if ln.lower().startswith("origin:"):
-            origin = ln.split(":",1)[1].strip()
-            break
-
-    body = ""
-    if "\r\n\r\n" in raw:
-        body = raw.split("\r\n\r\n", 1)[1]
-
-    if method == "OPTIONS":
-        allow_origin = origin if origin else "*"
-        resp = (
-            "HTTP/1.1 204 No Content\r\n"
-            f"Access-Control-Allow-Origin: {allow_origin}\r\n"
-            "Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS\r\n"
-            "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
-            "Access-Control-Allow-Credentials: true\r\n"
-            "Access-Control-Max-Age: 86400\r\n"
-            "Content-Length: 0\r\n"
-            "Connection: close\r\n\r\n"
-        )
-        conn.sendall(resp.encode())
-        conn.close()
-        return
-
-    result = process_backend_routes(method, path, body)
-    if result is not None:
-        out = json.dumps(result)
-        allow_origin = origin if origin else "*"
-        resp = (
-            "HTTP/1.1 200 OK\r\n"
-            "Content-Type: application/json\r\n"
-            f"Content-Length: {len(out.encode('utf-8'))}\r\n"
-            f"Access-Control-Allow-Origin: {allow_origin}\r\n"
-            "Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS\r\n"
-            "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
-            "Access-Control-Allow-Credentials: true\r\n"
-            "Connection: close\r\n\r\n" +
-            out
-        )
-        conn.sendall(resp.encode())
-        conn.close()
-        return
-
-    HttpAdapter(ip, port, conn, addr, {}).handle_client(conn, addr, {})
-
-def run_backend(ip, port):
+    # merged and compiled once, not per connection
+    routes = backend_routes(routes)
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.bind((ip, port))
     s.listen(50)
     print("[Backend] Listening on", port)
     while True:
         conn, addr = s.accept()
-        threading.Thread(target=handle_backend, args=(ip, port, conn, addr), daemon=True).start()
-
-def create_backend(ip, port, routes={}):
-    run_backend(ip, port)
+        threading.Thread(target=handle_backend, args=(ip, port, conn, addr, routes), daemon=True).start()
+
+def create_backend(ip, port, routes={}, event_loop=False, store=None,
+                   liveness=None, **store_options):
+    if store:
+        use_store(store, **store_options)
+    if liveness:
+        use_liveness(liveness)
+    get_tracker()
+    run_backend(ip, port, routes, event_loop)
@@ -0,0 +1,248 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.balancer
+~~~~~~~~~~~~~~~~~
+
+This module implements the load-balancing policies selected by the
+``dist_policy`` directive of ``config/proxy.conf``:
+
+- ``round-robin``: every upstream in turn.
+- ``weighted-round-robin``: smooth weighted round-robin on ``weight=``.
+- ``least-connections``: fewest in-flight requests per unit of weight.
+- ``consistent-hash [ip|cookie:<name>]``: a hash ring keyed by client IP
+  (default) or by a cookie value, so a client sticks to one upstream and
+  only ~1/N of the keys move when an upstream is added or removed.
+
+All policies are safe to call from concurrent proxy threads and only pick
+upstreams whose :class:`HealthState <daemon.health.HealthState>` is not
+ejected.
+"""
+
+import bisect
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from .health import HealthState
+
+DEFAULT_POLICY = "round-robin"
+
+#: Virtual nodes per unit of weight on the consistent-hash ring.
+HASH_REPLICAS = 100
+
+
+class Upstream:
+    """One ``host:port`` member of an upstream group."""
+
+    def __init__(self, host, port, weight=1, health=None):
+        self.host = host
+        self.port = int(port)
+        self.weight = max(1, int(weight))
+        self.active = 0              # in-flight requests
+        self.current_weight = 0      # smooth weighted round-robin state
+        self.health = health or HealthState(self.address)
+
+    @property
+    def address(self):
+        return "{}:{}".format(self.host, self.port)
+
+    def __repr__(self):
+        return "Upstream({}, weight={})".format(self.address, self.weight)
+
+
+def parse_upstream(spec):
+    """
+    Parse a ``proxy_pass`` target such as ``"10.0.0.2:9002 weight=3"``.
+
+    :rtype: Upstream
+    """
+    parts = spec.split()
+    host, _, port = parts[0].partition(":")
+    weight = 1
+    for option in parts[1:]:
+        key, _, value = option.partition("=")
+        if key == "weight":
+            try:
+                weight = int(value)
+            except ValueError:
+                pass
+    # the proxy has always fallen back to the tracker port on a bad target
+    return Upstream(host, port if port.isdigit() else 9000, weight)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class UpstreamGroup:
+    """Members of one virtual host and the policy that picks among them.
+
+    Usage::
+      >>> group = UpstreamGroup(["10.0.0.1:9001", "10.0.0.2:9001 weight=2"],
+      >>>                       "weighted-round-robin")
+      >>> member = group.choose(client_ip="10.0.0.9")
+      >>> with group.track(member):
+      >>>     forward(member.host, member.port)
+    """
+
+    def __init__(self, targets, policy=DEFAULT_POLICY):
+        self.members = [parse_upstream(t) for t in targets]
+        parts = (policy or DEFAULT_POLICY).split()
+        self.policy = parts[0]
+        self.hash_key = parts[1] if len(parts) > 1 else "ip"
+        self._lock = threading.Lock()
+        self._next = 0
+        self._ring = []
+        self._ring_keys = []
+        if self.policy == "consistent-hash":
+            self._build_ring()
+
+    def _build_ring(self):
+        ring = []
+        for member in self.members:
+            for i in range(HASH_REPLICAS * member.weight):
+                ring.append((_hash("{}#{}".format(member.address, i)), member))
+        ring.sort(key=lambda item: item[0])
+        self._ring = ring
+        self._ring_keys = [h for h, _ in ring]
+
+    def candidates(self):
+        """Members eligible for selection (not ejected)."""
+        now = time.monotonic()
+        return [m for m in self.members if m.health.available(now)]
+
+    def next_candidate(self, tried, client_ip=None, cookies=None):
+        """
+        Pick the member to retry a request on after the ones in ``tried``
+        failed, with the group's policy, or ``None`` if none is left.
+        """
+        return self.choose(client_ip, cookies, exclude=tried)
+
+    def choose(self, client_ip=None, cookies=None, exclude=()):
+        """
+        Pick an upstream for one request.
+
+        :param client_ip (str): Client address, for ``consistent-hash ip``.
+        :param cookies (dict): Request cookies, for ``consistent-hash cookie:<name>``.
+        :param exclude (set): Members not to pick (already tried).
+        :rtype: Upstream or None if the group has no eligible member.
+        """
+        members = [m for m in self.candidates() if m not in exclude]
+        if not members:
+            return None
+        if len(members) == 1:
+            return members[0]
+
+        with self._lock:
+            if self.policy in ("weighted-round-robin", "weighted"):
+                return self._weighted(members)
+            if self.policy in ("least-connections", "least-conn"):
+                return min(members, key=lambda m: (m.active / m.weight, -m.weight))
+            if self.policy == "consistent-hash":
+                return self._hashed(members, client_ip, cookies)
+            member = members[self._next % len(members)]
+            self._next += 1
+            return member
+
+    def _weighted(self, members):
+        # nginx smooth weighted round-robin: spreads heavy members out
+        total = 0
+        best = None
+        for m in members:
+            m.current_weight += m.weight
+            total += m.weight
+            if best is None or m.current_weight > best.current_weight:
+                best = m
+        best.current_weight -= total
+        return best
+
+    def _hashed(self, members, client_ip, cookies):
+        key = client_ip or ""
+        if self.hash_key.startswith("cookie:"):
+            key = (cookies or {}).get(self.hash_key[len("cookie:"):]) or key
+        if not self._ring:
+            return members[0]
+        allowed = set(id(m) for m in members)
+        start = bisect.bisect(self._ring_keys, _hash(key))
+        # walk clockwise to the first eligible member
+        for i in range(len(self._ring)):
+            member = self._ring[(start + i) % len(self._ring)][1]
+            if id(member) in allowed:
+                return member
+        return members[0]
+
+    @contextmanager
+    def track(self, member):
+        """Count ``member`` as busy for the duration of one request."""
+        with self._lock:
+            member.active += 1
+        try:
+            yield member
+        finally:
+            with self._lock:
+                member.active -= 1
+
+
+class Balancer:
+    """Lazily built :class:`UpstreamGroup` per virtual host of ``routes``.
+
+    ``routes`` maps a hostname to ``(proxy_pass, policy)`` as produced by
+    ``start_proxy.parse_virtual_hosts``; ``proxy_pass`` is a target string or
+    a list of them.
+    """
+
+    def __init__(self, routes, fallback="127.0.0.1:9000", **health_options):
+        self.routes = routes
+        self.fallback = fallback
+        self.groups = {}
+        self.health = {}            # address -> HealthState
+        self.health_options = health_options
+        self._lock = threading.Lock()
+
+    def upstreams(self):
+        """
+        Build every configured group and return one ``(host, port, state)``
+        per distinct upstream address.
+        """
+        for hostname in list(self.routes):
+            self.group(hostname)
+        seen = {}
+        with self._lock:
+            for group in self.groups.values():
+                for m in group.members:
+                    seen.setdefault(m.address, (m.host, m.port, m.health))
+        return list(seen.values())
+
+    def group(self, hostname):
+        # unknown hosts share one fallback group so arbitrary Host headers
+        # cannot grow the cache
+        key = hostname if hostname in self.routes else None
+        with self._lock:
+            group = self.groups.get(key)
+            if group is None:
+                targets, policy = self.routes.get(key, (self.fallback, DEFAULT_POLICY))
+                if isinstance(targets, str):
+                    targets = [targets]
+                if not targets:
+                    print("[Proxy] No routes configured. Using fallback", self.fallback)
+                    targets = [self.fallback]
+                group = UpstreamGroup(targets, policy)
+                # share one health record per address across virtual hosts
+                for m in group.members:
+                    if m.address not in self.health:
+                        self.health[m.address] = HealthState(m.address, **self.health_options)
+                    m.health = self.health[m.address]
+                self.groups[key] = group
+            return group
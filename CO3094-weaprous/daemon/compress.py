@@ -0,0 +1,92 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.compress
+~~~~~~~~~~~~~~~~~
+
+This module provides HTTP content encoding (``gzip`` and ``deflate``) with
+the standard :mod:`zlib` module.
+
+:func:`accepted_encoding` picks the encoding to use from a request's
+``Accept-Encoding`` header and :func:`compress` encodes a body with it.
+Static files keep their encoded variants in the :class:`FileCache
+<daemon.filecache.FileCache>`; JSON responses are compressed on the fly
+once they reach :data:`COMPRESS_MIN_SIZE`.
+
+Usage::
+  >>> encoding = accepted_encoding("gzip, deflate, br")
+  >>> encoding
+  'gzip'
+  >>> body = compress(b'{"messages": []}', encoding)
+"""
+
+import zlib
+
+#: Supported encodings, most preferred first, with their zlib ``wbits``
+#: (gzip container, and the zlib container HTTP calls "deflate").
+ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+#: Bodies smaller than this are sent as they are.
+COMPRESS_MIN_SIZE = 1024
+
+#: zlib level for static files, compressed once per file version.
+STATIC_LEVEL = 9
+
+#: zlib level for dynamic responses, compressed on every request.
+DYNAMIC_LEVEL = 6
+
+#: Content types worth compressing (images are already compressed).
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json",
+                      "application/xml", "image/svg+xml")
+
+
+def is_compressible(mime_type):
+    return bool(mime_type) and mime_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def accepted_encoding(header):
+    """
+    Return the encoding of :data:`ENCODINGS` preferred by an
+    ``Accept-Encoding`` header value, or ``None`` for identity.
+    """
+    if not header:
+        return None
+    qualities = {}
+    wildcard = None
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == "*":
+            wildcard = q
+        elif name in ENCODINGS:
+            qualities[name] = q
+    best, best_q = None, 0.0
+    for name in ENCODINGS:
+        q = qualities.get(name, wildcard or 0.0)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(data, encoding, level=DYNAMIC_LEVEL):
+    """Encode ``data`` (bytes) with ``encoding``, a key of :data:`ENCODINGS`."""
+    c = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return c.compress(data) + c.flush()
@@ -0,0 +1,280 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.eventloop
+~~~~~~~~~~~~~~~~~
+
+This module provides a :class:`EventLoopServer <EventLoopServer>` which serves
+many connections from a single ``selectors`` loop (epoll on Linux) instead of
+one thread per accepted socket.
+
+Idle connections only cost a selector registration. When a connection becomes
+readable it is unregistered and handed to a bounded worker pool, which runs the
+blocking per-connection handler (for example ``HttpAdapter.handle_client``).
+A session with a ``feed(data)`` attribute is read by the loop itself instead:
+the loop receives without blocking, feeds the bytes, and only hands the
+connection to a worker once ``feed`` returns ``True`` (a whole request is
+buffered), so a client trickling in a request never holds a worker.
+If the handler returns a truthy value the connection is re-armed in the loop,
+otherwise it is closed. A handler that takes the socket over for good (for
+example a long-lived event stream served from its own thread) returns
+:data:`DETACHED` and the loop forgets the connection without closing it.
+"""
+
+import collections
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+#: Default number of worker threads running connection handlers.
+WORKERS = 32
+
+#: Default listen backlog for the accepting socket.
+BACKLOG = 1024
+
+#: Bytes read per readiness event for sessions fed by the loop.
+RECV_SIZE = 64 * 1024
+
+#: Session return value: the handler now owns the socket.
+DETACHED = "detached"
+
+_ACCEPT = "accept"
+_WAKEUP = "wakeup"
+
+
+def raise_nofile_limit():
+    """Raise the soft open-files limit up to the hard limit.
+
+    Tens of thousands of idle connections need as many file descriptors,
+    which the default soft limit (often 1024) does not allow.
+    """
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+class _Connection:
+    __slots__ = ("sock", "addr", "session", "last_active")
+
+    def __init__(self, sock, addr, session):
+        self.sock = sock
+        self.addr = addr
+        self.session = session
+        self.last_active = time.monotonic()
+
+
+class EventLoopServer:
+    """Non-blocking accept/readiness loop with a bounded handler pool.
+
+    Usage::
+      >>> def factory(conn, addr):
+      >>>     adapter = HttpAdapter(ip, port, conn, addr, routes)
+      >>>     return lambda: adapter.handle_client(conn, addr, routes)
+      >>> EventLoopServer("0.0.0.0", 9000, factory).serve_forever()
+
+    :param ip (str): IP address to bind.
+    :param port (int): Port number to listen on.
+    :param factory (callable): ``factory(conn, addr)`` called once per accepted
+        connection, returning a zero-argument callable run on every readiness
+        event. Returning a truthy value keeps the connection open. If the
+        callable has a ``feed(data)`` attribute, the loop reads the socket
+        and runs the callable only once ``feed`` returns ``True``.
+    :param workers (int): Size of the handler thread pool.
+    :param idle_timeout (float): Close connections idle in the loop longer than
+        this many seconds (``None`` disables the sweep).
+    :param io_timeout (float): Socket timeout applied while a handler runs.
+    :param name (str): Log prefix.
+    """
+
+    def __init__(self, ip, port, factory, workers=WORKERS, backlog=BACKLOG,
+                 idle_timeout=None, io_timeout=30, name="Server"):
+        self.ip = ip
+        self.port = port
+        self.factory = factory
+        self.workers = workers
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.io_timeout = io_timeout
+        self.name = name
+
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._idle = collections.OrderedDict()   # fd -> _Connection, oldest first
+        self._rearm = collections.deque()
+        self._rearm_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._running = False
+
+    def serve_forever(self):
+        raise_nofile_limit()
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.ip, self.port))
+        server.listen(self.backlog)
+        server.setblocking(False)
+
+        self.selector.register(server, selectors.EVENT_READ, _ACCEPT)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, _WAKEUP)
+        self._running = True
+        print("[{}] Event loop listening on {}:{} ({} workers)".format(
+            self.name, self.ip, self.port, self.workers))
+
+        try:
+            while self._running:
+                timeout = 1.0 if self.idle_timeout else None
+                for key, _ in self.selector.select(timeout):
+                    if key.data == _ACCEPT:
+                        self._accept(key.fileobj)
+                    elif key.data == _WAKEUP:
+                        self._drain_wakeup()
+                    else:
+                        self._dispatch(key.data)
+                if self.idle_timeout:
+                    self._sweep_idle()
+        finally:
+            self.selector.close()
+            server.close()
+            self.pool.shutdown(wait=False)
+
+    def stop(self):
+        self._running = False
+        self._wakeup()
+
+    def _accept(self, server):
+        # accept everything queued so a burst costs one wakeup
+        while True:
+            try:
+                conn, addr = server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print("[{}] Accept error: {}".format(self.name, e))
+                return
+            try:
+                session = self.factory(conn, addr)
+            except Exception as e:
+                print("[{}] Connection setup failed: {}".format(self.name, e))
+                conn.close()
+                continue
+            self._arm(_Connection(conn, addr, session))
+
+    def _arm(self, entry):
+        try:
+            entry.sock.setblocking(False)
+            self.selector.register(entry.sock, selectors.EVENT_READ, entry)
+        except (ValueError, OSError, KeyError):
+            self._close(entry)
+            return
+        entry.last_active = time.monotonic()
+        self._idle[entry.sock.fileno()] = entry
+
+    def _dispatch(self, entry):
+        fd = entry.sock.fileno()
+        feed = getattr(entry.session, "feed", None)
+        if feed is not None:
+            try:
+                data = entry.sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                data = b""
+            try:
+                # on EOF the worker still runs, to see it and close
+                ready = not data or feed(data)
+            except Exception as e:
+                print("[{}] Feed error from {}: {}".format(self.name, entry.addr, e))
+                ready = True
+            if not ready:
+                entry.last_active = time.monotonic()
+                if fd in self._idle:
+                    self._idle.move_to_end(fd)
+                return
+        self._idle.pop(fd, None)
+        try:
+            self.selector.unregister(entry.sock)
+        except (ValueError, KeyError):
+            pass
+        entry.sock.settimeout(self.io_timeout)
+        self.pool.submit(self._run, entry)
+
+    def _run(self, entry):
+        keep = False
+        try:
+            keep = entry.session()
+        except Exception as e:
+            print("[{}] Handler error from {}: {}".format(self.name, entry.addr, e))
+        if keep is DETACHED:
+            return
+        if keep and entry.sock.fileno() != -1:
+            with self._rearm_lock:
+                self._rearm.append(entry)
+            self._wakeup()
+        else:
+            self._close(entry)
+
+    def _wakeup(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending
+
+    def _drain_wakeup(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        with self._rearm_lock:
+            pending, self._rearm = self._rearm, collections.deque()
+        for entry in pending:
+            self._arm(entry)
+
+    def _sweep_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        while self._idle:
+            fd, entry = next(iter(self._idle.items()))
+            if entry.last_active > deadline:
+                break
+            del self._idle[fd]
+            try:
+                self.selector.unregister(entry.sock)
+            except (ValueError, KeyError):
+                pass
+            self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry.sock.close()
+        except OSError:
+            pass
+
+
+def serve(ip, port, factory, name="Server", **kwargs):
+    """Convenience wrapper: build an :class:`EventLoopServer` and run it."""
+    EventLoopServer(ip, port, factory, name=name, **kwargs).serve_forever()
@@ -0,0 +1,160 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.events
+~~~~~~~~~~~~~~~~~
+
+This module provides server-push for WeApRous applications with
+Server-Sent Events (``text/event-stream``).
+
+An :class:`EventBus` fans published events out to subscribers and keeps the
+last few for replay. A route hook returns an :class:`EventStream` to turn
+its response into a stream; :class:`HttpAdapter <daemon.httpadapter.HttpAdapter>`
+then writes every event of the bus to the client until it disconnects. A
+hook whose answer has to wait for the next event returns a
+:class:`LongPoll` instead, so the wait does not hold an event-loop worker.
+
+Usage::
+  >>> bus = EventBus()
+  >>> @app.route("/events", methods=["GET"])
+  >>> def events(headers, body):
+  >>>     return EventStream(bus, headers.get("last-event-id"))
+  >>> bus.publish("message", {"from": "127.0.0.1:7001", "msg": "hi"})
+"""
+
+import json
+import queue
+import threading
+from collections import deque, namedtuple
+
+#: Events kept for replay to clients reconnecting with ``Last-Event-ID``.
+EVENT_HISTORY = 256
+
+#: Events queued per subscriber before it is dropped as too slow.
+SUBSCRIBER_QUEUE = 256
+
+#: Seconds between keep-alive comments on an idle stream.
+KEEPALIVE_INTERVAL = 15
+
+#: Reconnect delay suggested to clients, in milliseconds.
+RETRY_MS = 3000
+
+
+def format_event(event_id, event, data):
+    """Encode one event in the ``text/event-stream`` format."""
+    payload = json.dumps(data)
+    return "id: {}\nevent: {}\ndata: {}\n\n".format(event_id, event, payload).encode("utf-8")
+
+
+#: One published event; ``frame`` is its ``text/event-stream`` encoding.
+Event = namedtuple("Event", "id event data frame")
+
+
+class Subscription:
+    """Queue of :class:`Event` for one connected client."""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # the client reconnects and catches up from the history
+            self.dropped = True
+
+    def get(self, timeout=None):
+        """Return the next :class:`Event`, or ``None`` after ``timeout``."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """Publish/subscribe hub with numbered events and a replay window."""
+
+    def __init__(self, history=EVENT_HISTORY):
+        self.history = deque(maxlen=history)   # Event
+        self.subscribers = set()
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def publish(self, event, data):
+        """Send ``data`` (JSON-serializable) as ``event`` to every subscriber."""
+        with self._lock:
+            self.last_id += 1
+            item = Event(self.last_id, event, data, format_event(self.last_id, event, data))
+            self.history.append(item)
+            # under the lock so every subscriber sees events in id order;
+            # put() never blocks
+            for sub in self.subscribers:
+                sub.put(item)
+            return self.last_id
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a subscriber. With ``last_event_id`` the events published
+        after it that are still in the history are queued first.
+
+        :rtype: Subscription
+        """
+        sub = Subscription()
+        with self._lock:
+            if last_event_id is not None:
+                if last_event_id > self.last_id:
+                    last_event_id = 0       # ids from before a restart
+                for item in self.history:
+                    if item.id > last_event_id:
+                        sub.put(item)
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self.subscribers.discard(sub)
+
+
+class EventStream:
+    """Route hook result asking the adapter to stream ``bus`` to the client.
+
+    :param bus (EventBus): Source of the events.
+    :param last_event_id (str): ``Last-Event-ID`` request header, if any.
+    """
+
+    def __init__(self, bus, last_event_id=None):
+        self.bus = bus
+        try:
+            self.last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            self.last_event_id = None
+
+
+class LongPoll:
+    """Route hook result whose answer may take a while to come.
+
+    ``wait()`` blocks until there is something to send and returns the
+    response body, as a route hook would. In evented mode the adapter calls
+    it on its own thread, like an event stream, and closes the connection
+    after the answer.
+
+    Usage::
+      >>> def get_messages(headers, body, query):
+      >>>     return LongPoll(lambda: log.wait(int(query["since"]), 25))
+
+    :param wait (callable): Called with no arguments; returns the body.
+    """
+
+    def __init__(self, wait):
+        self.wait = wait
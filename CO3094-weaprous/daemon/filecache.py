@@ -0,0 +1,168 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.filecache
+~~~~~~~~~~~~~~~~~
+
+This module keeps static files served by :class:`Response
+<daemon.response.Response>` in memory.
+
+A :class:`FileCache` maps a resolved file path to a :class:`CachedFile`
+holding the file bytes and its prebuilt ``Content-Type``/``Content-Length``
+header lines. Entries are evicted least recently used first once the cached
+bytes exceed ``max_bytes``. A cached file is checked against the disk (one
+``stat``, comparing mtime and size) at most once per ``revalidate``
+seconds, so a hot asset costs no filesystem call in between.
+
+Files larger than ``max_file`` are never read here: their entry only holds
+the metadata (``content`` is ``None``) and the response streams them from
+disk. Compressed variants of a cached file are built on first use by
+:meth:`FileCache.encoded` and count towards ``max_bytes``.
+"""
+
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from .compress import STATIC_LEVEL, compress
+
+#: Total bytes of file content kept in memory.
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+#: Files larger than this are streamed from disk on every request.
+CACHE_MAX_FILE = 2 * 1024 * 1024
+
+#: Seconds a cached file is trusted before its mtime and size are checked.
+REVALIDATE_INTERVAL = 2
+
+
+class CachedFile:
+    """One file version: its bytes (``None`` for a file too large to keep)
+    plus the header lines describing them.
+
+    ``etag`` (size and mtime, like most servers) and ``last_modified`` are
+    computed once per version and serve conditional requests.
+    """
+
+    __slots__ = ("path", "content", "mime_type", "size", "mtime", "header",
+                 "etag", "last_modified", "checked", "variants")
+
+    def __init__(self, path, content, mime_type, st):
+        self.path = path
+        self.content = content
+        self.mime_type = mime_type
+        self.size = st.st_size
+        self.mtime = st.st_mtime_ns
+        self.header = "Content-Type: {}\r\nContent-Length: {}\r\n".format(
+            mime_type, st.st_size if content is None else len(content)).encode("ascii")
+        self.etag = '"{:x}-{:x}"'.format(st.st_size, st.st_mtime_ns)
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.checked = time.monotonic()
+        self.variants = {}       # encoding -> compressed bytes, None if not smaller
+
+
+def _nbytes(entry):
+    size = len(entry.content) if entry.content is not None else 0
+    return size + sum(len(v) for v in entry.variants.values() if v)
+
+
+class FileCache:
+    """Byte-bounded LRU cache of static files.
+
+    Usage::
+      >>> cache = FileCache(max_bytes=8 * 1024 * 1024)
+      >>> entry = cache.get("/srv/static/js/chat.js", "application/javascript")
+      >>> entry.header + entry.content
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_file=CACHE_MAX_FILE,
+                 revalidate=REVALIDATE_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.revalidate = revalidate
+        self.entries = OrderedDict()     # path -> CachedFile, least recent first
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, mime_type):
+        """
+        Return the :class:`CachedFile` of ``path``, reading it if it is not
+        cached or changed on disk, or ``None`` if it is not a readable file.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.mime_type == mime_type \
+                    and now - entry.checked < self.revalidate:
+                self.entries.move_to_end(path)
+                return entry
+
+        try:
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                raise IsADirectoryError(path)
+            if entry is not None and entry.mime_type == mime_type \
+                    and (st.st_mtime_ns, st.st_size) == (entry.mtime, entry.size):
+                entry.checked = now
+                return entry
+            content = None
+            if st.st_size <= self.max_file:
+                with open(path, "rb") as f:
+                    content = f.read()
+        except (OSError, ValueError):
+            self.discard(path)
+            return None
+
+        entry = CachedFile(path, content, mime_type, st)
+        with self._lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= _nbytes(old)
+            self.entries[path] = entry
+            self.size += _nbytes(entry)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= _nbytes(evicted)
+        return entry
+
+    def encoded(self, entry, encoding):
+        """
+        Return the content of ``entry`` compressed with ``encoding``, built
+        once per file version, or ``None`` if compressing does not make it
+        smaller.
+        """
+        if encoding in entry.variants:
+            return entry.variants[encoding]
+        data = compress(entry.content, encoding, STATIC_LEVEL)
+        if len(data) >= len(entry.content):
+            data = None
+        with self._lock:
+            if encoding not in entry.variants:
+                entry.variants[encoding] = data
+                if data and self.entries.get(entry.path) is entry:
+                    self.size += len(data)
+            return entry.variants[encoding]
+
+    def discard(self, path):
+        with self._lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= _nbytes(old)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
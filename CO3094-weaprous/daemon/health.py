@@ -0,0 +1,151 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.health
+~~~~~~~~~~~~~~~~~
+
+This module tracks upstream health for the proxy.
+
+Every upstream has a :class:`HealthState`. Failures are reported passively
+by the proxy (connect errors, no response) and actively by a
+:class:`HealthChecker` thread that probes each upstream with a TCP connect or
+an HTTP request. After ``max_fails`` consecutive failures the upstream is
+ejected for a backoff that doubles on every ejection (up to ``max_backoff``).
+When the backoff expires the upstream is tried again; one more failure
+ejects it again, a success re-admits it fully.
+"""
+
+import socket
+import threading
+import time
+
+#: Consecutive failures before an upstream is ejected.
+MAX_FAILS = 3
+
+#: First ejection backoff in seconds, doubled on each further ejection.
+BACKOFF_BASE = 5
+
+#: Longest ejection backoff in seconds.
+BACKOFF_MAX = 60
+
+#: Seconds between active probes of one upstream.
+CHECK_INTERVAL = 5
+
+#: Seconds a single probe may take.
+CHECK_TIMEOUT = 1
+
+
+class HealthState:
+    """Failure counters and ejection window of one upstream address."""
+
+    def __init__(self, address, max_fails=MAX_FAILS,
+                 backoff=BACKOFF_BASE, max_backoff=BACKOFF_MAX):
+        self.address = address
+        self.max_fails = max_fails
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self._lock = threading.Lock()
+
+    def available(self, now=None):
+        """Return ``True`` if the upstream may receive traffic."""
+        return (now or time.monotonic()) >= self.ejected_until
+
+    def record_success(self):
+        if not self.failures and not self.ejections:
+            return
+        with self._lock:
+            if self.ejections:
+                print("[Health] {} re-admitted".format(self.address))
+            self.failures = 0
+            self.ejections = 0
+            self.ejected_until = 0.0
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            if not self.available(now):
+                return
+            self.failures += 1
+            # after a backoff the upstream is on probation: one strike ejects
+            threshold = 1 if self.ejections else self.max_fails
+            if self.failures < threshold:
+                return
+            delay = min(self.max_backoff, self.backoff * (2 ** self.ejections))
+            self.ejections += 1
+            self.failures = 0
+            self.ejected_until = now + delay
+        print("[Health] {} ejected for {}s".format(self.address, delay))
+
+
+def tcp_probe(host, port, timeout=CHECK_TIMEOUT):
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+        return True
+    except socket.error:
+        return False
+
+
+def http_probe(host, port, path="/", timeout=CHECK_TIMEOUT):
+    """Healthy if ``GET path`` answers with a status below 500."""
+    try:
+        s = socket.create_connection((host, port), timeout=timeout)
+    except socket.error:
+        return False
+    try:
+        s.sendall((
+            "GET {} HTTP/1.1\r\n"
+            "Host: {}:{}\r\n"
+            "Connection: close\r\n\r\n"
+        ).format(path, host, port).encode())
+        line = s.recv(64).split(b"\r\n", 1)[0].split()
+        return len(line) >= 2 and line[1].isdigit() and int(line[1]) < 500
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+
+class HealthChecker:
+    """Background prober, one thread per upstream of a :class:`Balancer`.
+
+    :param probe (str): ``"tcp"`` for a plain connect, or ``"http:<path>"``
+        for an HTTP ``GET`` of ``<path>``.
+    """
+
+    def __init__(self, balancer, probe="tcp", interval=CHECK_INTERVAL, timeout=CHECK_TIMEOUT):
+        self.balancer = balancer
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+
+    def check(self, host, port):
+        if self.probe.startswith("http"):
+            path = self.probe.partition(":")[2] or "/"
+            return http_probe(host, port, path, self.timeout)
+        return tcp_probe(host, port, self.timeout)
+
+    def start(self):
+        for host, port, state in self.balancer.upstreams():
+            threading.Thread(target=self._run, args=(host, port, state), daemon=True).start()
+
+    def _run(self, host, port, state):
+        while True:
+            time.sleep(self.interval)
+            if self.check(host, port):
+                if state.available():
+                    state.record_success()
+            else:
+                state.record_failure()
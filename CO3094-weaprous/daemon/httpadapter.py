@@ -1,7 +1,16 @@
+import functools
+import inspect
 import os
+import socket
+import threading
 from urllib.parse import unquote
-from .request import Request
-from .response import Response
+from .request import Request, HttpParser, HttpParseError
+from .response import FileRange, Response
+from .compress import COMPRESS_MIN_SIZE, accepted_encoding, compress
+from .events import EventStream, LongPoll, KEEPALIVE_INTERVAL, RETRY_MS
+from .websocket import WebSocket, accept_key
+from .eventloop import DETACHED
+from .router import find_route
 import json
 
 CORS_HEADERS = {
@@ -11,10 +20,28 @@ CORS_HEADERS = {
     "Access-Control-Max-Age": "86400"
 }
 
+#: Seconds an idle persistent connection is kept open between requests.
+KEEPALIVE_TIMEOUT = 5
+
+#: Requests served on one connection before it is closed.
+KEEPALIVE_MAX_REQUESTS = 100
+
+@functools.lru_cache(maxsize=None)
+def _hook_accepts(func, name):
+    """Return ``True`` if ``func`` takes a keyword argument ``name``."""
+    try:
+        params = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+    return name in params or any(p.kind == p.VAR_KEYWORD for p in params.values())
+
+
 class HttpAdapter:
-    __attrs__ = ["ip","port","conn","connaddr","routes","request","response"]
+    __attrs__ = ["ip","port","conn","connaddr","routes","request","response",
+                 "evented","keep_alive","served","parser","detached"]
 
-    def __init__(self, ip, port, conn, connaddr, routes):
+    def __init__(self, ip, port, conn, connaddr, routes, evented=False,
+                 idle_timeout=KEEPALIVE_TIMEOUT, max_requests=KEEPALIVE_MAX_REQUESTS):
         self.ip = ip
         self.port = port
         self.conn = conn
@@ -23,6 +50,16 @@ class HttpAdapter:
         self.request = Request()
         self.response = Response()
 
+        # persistent connection state
+        self.evented = evented
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.keep_alive = False
+        self.served = 0
+        self.parser = HttpParser()
+        # set once the socket is handed to an event stream thread
+        self.detached = False
+
     def parse_form(self, body):
         params = {}
         if not body:
@@ -33,58 +70,315 @@ class HttpAdapter:
                 params[k] = unquote(v)
         return params
 
-    def _write(self, txt):
+    def _write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
         try:
-            self.conn.sendall(txt.encode())
-        finally:
-            try:
-                self.conn.close()
-            except:
-                pass
+            self.conn.sendall(data)
+        except OSError:
+            self.keep_alive = False
 
-    def send_json(self, obj, extra_headers=None, status=200, status_text="OK"):
-        txt = json.dumps(obj)
+    def _write_payload(self, head, payload):
+        """
+        Write ``head`` followed by a :attr:`Response.payload`: bytes go out
+        in one gathered ``sendmsg`` without being joined to the head, a
+        :class:`FileRange` is streamed with ``socket.sendfile``.
+        """
+        conn = self.conn
+        try:
+            if payload is None:
+                conn.sendall(head)
+            elif isinstance(payload, FileRange):
+                with open(payload.path, "rb") as f:
+                    conn.sendall(head, getattr(socket, "MSG_MORE", 0))
+                    sent = conn.sendfile(f, payload.offset, payload.count) if payload.count else 0
+                if sent != payload.count:
+                    self.keep_alive = False     # file shrank, framing is lost
+            elif hasattr(conn, "sendmsg"):
+                parts = [memoryview(head), payload]
+                while parts:
+                    sent = conn.sendmsg(parts)
+                    while sent:
+                        if sent >= len(parts[0]):
+                            sent -= len(parts.pop(0))
+                        else:
+                            parts[0] = parts[0][sent:]
+                            sent = 0
+                    parts = [p for p in parts if len(p)]
+            else:
+                conn.sendall(head + payload)
+        except OSError:
+            self.keep_alive = False
+
+    def _connection_headers(self):
+        # ``served`` already counts the request being answered
+        remaining = max(0, self.max_requests - self.served)
+        if self.keep_alive:
+            return {
+                "Connection": "keep-alive",
+                "Keep-Alive": f"timeout={self.idle_timeout}, max={remaining}",
+            }
+        if not remaining:
+            return {"Connection": "close", "Keep-Alive": f"timeout={self.idle_timeout}, max=0"}
+        return {"Connection": "close"}
+
+    def _build_head(self, status, status_text, content_type, length, extra_headers):
+        headers = dict(CORS_HEADERS)
+        if extra_headers:
+            headers.update(extra_headers)
+        headers.update(self._connection_headers())
         lines = [f"HTTP/1.1 {status} {status_text}"]
-        lines.append("Content-Type: application/json")
-        lines.append(f"Content-Length: {len(txt.encode('utf-8'))}")
-        for k,v in CORS_HEADERS.items():
+        lines.append(f"Content-Type: {content_type}")
+        lines.append(f"Content-Length: {length}")
+        for k,v in headers.items():
             lines.append(f"{k}: {v}")
-        if extra_headers:
-            for k,v in extra_headers.items():
-                lines.append(f"{k}: {v}")
-        lines.append("Connection: close")
         lines.append("")
-        lines.append(txt)
-        self._write("\r\n".join(lines))
+        lines.append("")
+        return "\r\n".join(lines)
+
+    def _encode_body(self, data, headers):
+        """
+        Compress ``data`` for the current request if it is large enough and
+        the client accepts an encoding, adding the matching headers.
+        """
+        if len(data) < COMPRESS_MIN_SIZE:
+            return data
+        headers["Vary"] = "Accept-Encoding"
+        encoding = accepted_encoding((self.request.headers or {}).get("accept-encoding"))
+        if not encoding:
+            return data
+        encoded = compress(data, encoding)
+        if len(encoded) >= len(data):
+            return data
+        headers["Content-Encoding"] = encoding
+        return encoded
+
+    def send_json(self, obj, extra_headers=None, status=200, status_text="OK"):
+        txt = json.dumps(obj).encode("utf-8")
+        extra_headers = dict(extra_headers or {})
+        txt = self._encode_body(txt, extra_headers)
+        head = self._build_head(status, status_text, "application/json", len(txt), extra_headers)
+        self._write(head.encode() + txt)
 
     def send_text(self, body, content_type="text/plain", extra_headers=None, status=200, status_text="OK"):
-        b = body if isinstance(body, str) else str(body)
-        lines = [f"HTTP/1.1 {status} {status_text}"]
-        lines.append(f"Content-Type: {content_type}")
-        lines.append(f"Content-Length: {len(b.encode('utf-8'))}")
-        for k,v in CORS_HEADERS.items():
-            lines.append(f"{k}: {v}")
+        b = (body if isinstance(body, str) else str(body)).encode("utf-8")
+        head = self._build_head(status, status_text, content_type, len(b), extra_headers)
+        self._write(head.encode() + b)
+
+    def send_event_stream(self, stream, extra_headers=None):
+        """
+        Answer with ``text/event-stream`` and push the events of
+        ``stream.bus`` until the client goes away. The response has no
+        length, so the connection is closed when the stream ends.
+
+        In evented mode the stream runs on its own thread so it does not
+        hold an event-loop worker.
+        """
+        self.keep_alive = False
+        headers = dict(CORS_HEADERS)
         if extra_headers:
-            for k,v in extra_headers.items():
-                lines.append(f"{k}: {v}")
-        lines.append("Connection: close")
-        lines.append("")
-        lines.append(b)
-        self._write("\r\n".join(lines))
+            headers.update(extra_headers)
+        headers["Cache-Control"] = "no-cache"
+        headers["Connection"] = "close"
+        headers["X-Accel-Buffering"] = "no"
+        lines = ["HTTP/1.1 200 OK", "Content-Type: text/event-stream"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        head = ("\r\n".join(lines) + "\r\n\r\n" + f"retry: {RETRY_MS}\n\n").encode()
 
-    def handle_client(self, conn, addr, routes):
+        sub = stream.bus.subscribe(stream.last_event_id)
+        self._detach(self._pump_events, sub, stream.bus, head)
+
+    def send_long_poll(self, poll, extra_headers=None):
+        """
+        Answer with the JSON result of ``poll.wait()``. In evented mode the
+        wait runs on its own thread so it does not hold an event-loop worker,
+        and the connection is closed after the answer.
+        """
+        if self.evented:
+            self.keep_alive = False
+        self._detach(self._finish_long_poll, poll, extra_headers)
+
+    def _finish_long_poll(self, poll, extra_headers):
         try:
-            raw = conn.recv(8192).decode(errors="ignore")
-        except:
-            conn.close()
-            return
-        if not raw:
-            conn.close()
+            out = poll.wait()
+        except Exception as e:
+            out = {"error": "hook error", "detail": str(e)}
+        self.send_json(out, extra_headers=extra_headers)
+        if self.detached:
+            self._close()
+
+    def _detach(self, target, *args):
+        """
+        Run a long-lived session on this connection. In evented mode it gets
+        its own thread and the connection leaves the event loop.
+        """
+        if self.evented:
+            self.detached = True
+            threading.Thread(target=target, args=args, daemon=True).start()
+        else:
+            target(*args)
+
+    def _pump_events(self, sub, bus, head):
+        try:
+            self.conn.settimeout(KEEPALIVE_INTERVAL)
+            self.conn.sendall(head)
+            while not sub.dropped:
+                event = sub.get(timeout=KEEPALIVE_INTERVAL)
+                # a comment line keeps proxies from timing out an idle stream
+                self.conn.sendall(event.frame if event is not None else b": ping\n\n")
+        except OSError:
+            pass
+        finally:
+            bus.unsubscribe(sub)
+            if self.detached:
+                self._close()
+
+    def upgrade_websocket(self, handler, req, extra_headers=None):
+        """
+        Complete the RFC 6455 handshake and run ``handler(ws, headers)`` on
+        the upgraded connection until it returns.
+        """
+        self.keep_alive = False
+        key = req.headers.get("sec-websocket-key")
+        if req.method != "GET" or not key or req.headers.get("sec-websocket-version") != "13":
+            extra = dict(extra_headers or {})
+            extra["Sec-WebSocket-Version"] = "13"
+            self.send_text("Bad WebSocket handshake", extra_headers=extra,
+                           status=400, status_text="Bad Request")
             return
+        head = (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+        )
+        self._write(head)
+        # frames the client sent right after the handshake
+        prefix = bytes(self.parser.buffer)
+        self.parser.buffer.clear()
+        self._detach(self._run_websocket, handler, WebSocket(self.conn, prefix), req.headers)
+
+    def _run_websocket(self, handler, ws, headers):
+        try:
+            handler(ws, headers)
+        except Exception as e:
+            print("[HttpAdapter] WebSocket handler error:", e)
+        finally:
+            ws.close()
+            ws.join(5)
+            self._close()
+
+    def _param_kwargs(self, func, params):
+        """
+        Return the path parameters ``func`` declares, by name, plus
+        ``params`` (all of them) if it declares that.
+        """
+        kwargs = {name: value for name, value in params.items() if _hook_accepts(func, name)}
+        if _hook_accepts(func, "params"):
+            kwargs["params"] = params
+        return kwargs
+
+    def call_hook(self, req):
+        """
+        Call the route handler of ``req``. Handlers always get ``headers``
+        and ``body``; those that declare a ``query`` parameter also get the
+        parsed query string, and declared path parameters get their values.
+        """
+        kwargs = {"headers": req.headers, "body": req.body}
+        if _hook_accepts(req.hook, "query"):
+            kwargs["query"] = req.query
+        if req.params:
+            kwargs.update(self._param_kwargs(req.hook, req.params))
+        return req.hook(**kwargs)
+
+    def _read_request(self):
+        """
+        Return the next raw request from the connection, reading from the
+        socket as needed. Pipelined requests stay buffered in :attr:`parser`
+        for the next call. Returns ``None`` on EOF, timeout or socket error.
+        Malformed or oversized requests are answered with an error status.
+        """
+        try:
+            msg = self.parser.read_message(self.conn)
+        except HttpParseError as e:
+            self.keep_alive = False
+            self.send_text(e.reason, status=e.status, status_text=e.reason)
+            return None
+        if msg is None:
+            return None
+        head, body = msg
+        return (head + body).decode(errors="ignore")
+
+    def feed(self, data):
+        """
+        Buffer bytes the event loop read from the connection.
+
+        :rtype: bool - ``True`` once a whole request is buffered, so serving
+            it will not block on the socket.
+        """
+        self.parser.feed(data)
+        return self.parser.message_ready()
+
+    def _wants_keep_alive(self, req):
+        if self.served >= self.max_requests:
+            return False
+        token = (req.headers.get("connection") or "").lower()
+        if req.version == "HTTP/1.0":
+            return "keep-alive" in token
+        return "close" not in token
+
+    def _close(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+    def handle_client(self, conn, addr, routes):
+        """
+        Serve requests on a persistent connection.
+
+        Requests are answered in the order they arrive, including pipelined
+        ones. In threaded mode the connection waits up to ``idle_timeout`` for
+        the next request; in evented mode it returns ``True`` as soon as no
+        whole request is buffered, so the event loop parks the socket and
+        :meth:`feed` collects the rest instead of a worker waiting for it.
+        """
+        while True:
+            if not self.evented and not self.parser.pending():
+                try:
+                    conn.settimeout(self.idle_timeout)
+                except OSError:
+                    return False
+
+            raw = self._read_request()
+            if not raw:
+                self._close()
+                return False
+
+            self.served += 1
+            self.handle_request(raw, routes)
+
+            if self.detached:
+                return DETACHED
+            if not self.keep_alive:
+                self._close()
+                return False
+            if self.evented and not self.parser.message_ready():
+                return True
 
-        req = self.request
-        resp = self.response
+    @staticmethod
+    def _is_static(path):
+        return path.endswith(".html") or path.startswith(("/static", "/css", "/js", "/images"))
+
+    def handle_request(self, raw, routes):
+        req = self.request = Request()
+        resp = self.response = Response()
         req.prepare(raw, routes)
+        if not req.method or not req.path:
+            self.keep_alive = False
+            self.send_text("Bad Request", status=400, status_text="Bad Request")
+            return
+        self.keep_alive = self._wants_keep_alive(req)
 
         # compute dynamic CORS origin
         origin = req.headers.get("origin") or None
@@ -97,15 +391,29 @@ class HttpAdapter:
             "Access-Control-Max-Age": "86400"
         }
 
+        if "websocket" in (req.headers.get("upgrade") or "").lower():
+            handler, params, _ = find_route(routes, "WEBSOCKET", req.path)
+            if handler:
+                if params:
+                    handler = functools.partial(handler, **self._param_kwargs(handler, params))
+                self.upgrade_websocket(handler, req, cors_extra)
+                return
+
         if req.method == "OPTIONS":
             self.send_text("", content_type="text/plain", extra_headers=cors_extra, status=204, status_text="No Content")
             return
 
         if req.hook:
             try:
-                out = req.hook(headers=req.headers, body=req.body)
+                out = self.call_hook(req)
             except Exception as e:
                 out = {"error":"hook error", "detail": str(e)}
+            if isinstance(out, EventStream):
+                self.send_event_stream(out, extra_headers=cors_extra)
+                return
+            if isinstance(out, LongPoll):
+                self.send_long_poll(out, extra_headers=cors_extra)
+                return
             if isinstance(out, (dict,list)):
                 self.send_json(out, extra_headers=cors_extra)
                 return
@@ -120,6 +428,15 @@ class HttpAdapter:
             self.send_text(str(out), content_type="text/plain", extra_headers=cors_extra)
             return
 
+        # the path is a route, just not for this method
+        allowed = [m for m in (req.allowed or ()) if m != "WEBSOCKET"]
+        if allowed and not self._is_static(req.path):
+            extra = dict(cors_extra)
+            extra["Allow"] = ", ".join(allowed + ["OPTIONS"])
+            self.send_json({"error": "method not allowed"}, extra_headers=extra,
+                           status=405, status_text="Method Not Allowed")
+            return
+
         if req.method=="POST" and req.path in ("/login", "/login.html"):
             body = raw.split("\r\n\r\n",1)[1] if "\r\n\r\n" in raw else ""
             form = self.parse_form(body)
@@ -148,29 +465,33 @@ class HttpAdapter:
 
                     extra = {}
                     extra.update(cors_extra)
-                    header = (
-                        "HTTP/1.1 401 Unauthorized\r\n"
-                        "Content-Type: text/html\r\n"
-                        f"Content-Length: {len(html)}\r\n"
-                    )
-                    for k,v in extra.items():
-                        header += f"{k}: {v}\r\n"
-                    header += "Connection: close\r\n\r\n"
-
-                    self.conn.sendall(header.encode() + html)
-                    self.conn.close()
+                    header = self._build_head(401, "Unauthorized", "text/html", len(html), extra)
+                    self._write(header.encode() + html)
                     return
                 except:
                     self.send_text("401 Unauthorized", status=401, status_text="Unauthorized", extra_headers=cors_extra)
                     return
 
-        if req.path.endswith(".html") or req.path.startswith("/static") or req.path.startswith("/css") or req.path.startswith("/js") or req.path.startswith("/images"):
+        if self._is_static(req.path):
+            resp.headers.update(self._connection_headers())
             out = resp.build_response(req)
-            try:
-                self.conn.sendall(out)
-            finally:
-                try: self.conn.close()
-                except: pass
+            self._write_payload(out, resp.payload)
             return
 
         self.send_json({"error":"unknown route"}, extra_headers=cors_extra, status=404, status_text="Not Found")
+
+
+def adapter_factory(ip, port, routes):
+    """
+    Build a per-connection session factory for :class:`EventLoopServer`.
+
+    One :class:`HttpAdapter` is created per accepted socket. The loop feeds
+    it what the socket receives and runs its ``handle_client`` on a worker
+    once a whole request is buffered.
+    """
+    def factory(conn, addr):
+        adapter = HttpAdapter(ip, port, conn, addr, routes, evented=True)
+        session = functools.partial(adapter.handle_client, conn, addr, routes)
+        session.feed = adapter.feed
+        return session
+    return factory
@@ -0,0 +1,246 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.liveness
+~~~~~~~~~~~~~~~~~
+
+This module keeps the tracker's view of which registered peers are online.
+
+- :class:`LeaseTable` (default): peers hold a lease renewed by periodic
+  ``/heartbeat`` requests. Leases sit on a min-heap keyed by expiry and a
+  single thread sleeps until the earliest one lapses, so the tracker does
+  no work per peer unless a peer stops heartbeating.
+- :class:`PeerScanner`: probes every registered peer with a TCP connect,
+  concurrently on a bounded pool, and keeps an in-memory alive-set where
+  each entry expires ``ttl`` seconds after its last successful probe. For
+  clients that register once and never heartbeat.
+
+Both answer ``/get-list`` from a snapshot, so it costs neither probes nor
+storage reads, and both report peers that went away so they can be dropped
+from the store.
+"""
+
+import heapq
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#: Seconds a lease lasts without a heartbeat. Clients heartbeat every
+#: third of it.
+LEASE_TTL = 15
+
+#: Seconds of lateness allowed when expiring leases, so leases lapsing close
+#: together are expired in one batch.
+EXPIRY_GRANULARITY = 0.5
+
+#: Seconds between two scans.
+SCAN_INTERVAL = 5
+
+#: Seconds a single connect probe may take.
+PROBE_TIMEOUT = 0.5
+
+#: Seconds a peer stays listed after its last successful probe.
+PEER_TTL = 15
+
+#: Concurrent probes.
+SCAN_WORKERS = 32
+
+
+def probe(ip, port, timeout=PROBE_TIMEOUT):
+    try:
+        socket.create_connection((ip, port), timeout=timeout).close()
+        return True
+    except (socket.error, OverflowError, TypeError):
+        return False
+
+
+class PeerScanner:
+    """Background liveness scanner over the peers of a tracker store.
+
+    Usage::
+      >>> scanner = PeerScanner(store)
+      >>> scanner.start()
+      >>> scanner.peers()
+      [{'ip': '127.0.0.1', 'port': 7001}]
+    """
+
+    def __init__(self, store, interval=SCAN_INTERVAL, timeout=PROBE_TIMEOUT,
+                 ttl=PEER_TTL, workers=SCAN_WORKERS, on_expire=None):
+        self.store = store
+        self.on_expire = on_expire or store.remove_peers
+        self.interval = interval
+        self.timeout = timeout
+        self.ttl = ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe")
+        self.alive = {}              # (ip, port) -> expires_at
+        self._snapshot = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def peers(self):
+        """Return the cached list of live peers."""
+        return self._snapshot
+
+    def mark_alive(self, ip, port):
+        """
+        Record a peer as alive now, e.g. right after it registered.
+
+        :rtype: bool - ``True`` if the peer was not in the alive-set.
+        """
+        with self._lock:
+            new = (ip, port) not in self.alive
+            self.alive[(ip, port)] = time.monotonic() + self.ttl
+            if new:
+                self._rebuild()
+        return new
+
+    def _rebuild(self):
+        self._snapshot = [{"ip": ip, "port": port} for ip, port in self.alive]
+
+    def scan(self):
+        """Probe every registered peer once and refresh the alive-set."""
+        peers = [(p.get("ip"), p.get("port")) for p in self.store.list_peers()]
+        results = self.pool.map(lambda key: probe(key[0], key[1], self.timeout), peers)
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, ok in zip(peers, results):
+                if ok:
+                    self.alive[key] = now + self.ttl
+                elif self.alive.get(key, 0) <= now:
+                    self.alive.pop(key, None)
+                    expired.append({"ip": key[0], "port": key[1]})
+            self._rebuild()
+        if expired:
+            self.on_expire(expired)
+
+    def start(self):
+        """Run a first scan, then keep scanning in a daemon thread."""
+        self.scan()
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.scan()
+            except Exception as e:
+                print("[Tracker] Peer scan failed:", e)
+
+    def stop(self):
+        self._stop.set()
+        self.pool.shutdown(wait=False)
+
+
+class LeaseTable:
+    """Peer leases expiring in deadline order.
+
+    :param on_expire (callable): Called with the list of expired peers
+        (``{"ip", "port"}`` dicts), outside of the table lock.
+
+    Usage::
+      >>> leases = LeaseTable(ttl=15, on_expire=store.remove_peers)
+      >>> leases.start()
+      >>> leases.renew("127.0.0.1", 7001)
+      True
+      >>> leases.peers()
+      [{'ip': '127.0.0.1', 'port': 7001}]
+    """
+
+    def __init__(self, ttl=LEASE_TTL, on_expire=None):
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.leases = {}             # (ip, port) -> expires_at
+        self._heap = []              # (expires_at, ip, port), may hold stale entries
+        self._snapshot = []
+        self._cond = threading.Condition()
+        self._stop = False
+
+    def peers(self):
+        """Return the cached list of peers holding a lease."""
+        return self._snapshot
+
+    def renew(self, ip, port):
+        """
+        Grant or extend the lease of ``(ip, port)``.
+
+        :rtype: bool - ``True`` if the peer had no lease.
+        """
+        expires = time.monotonic() + self.ttl
+        with self._cond:
+            new = (ip, port) not in self.leases
+            self.leases[(ip, port)] = expires
+            # a renewal leaves the old heap entry behind; it is skipped when
+            # it surfaces because its deadline no longer matches
+            heapq.heappush(self._heap, (expires, ip, port))
+            if new:
+                self._rebuild()
+                if self._heap[0][0] == expires:
+                    self._cond.notify()
+        return new
+
+    mark_alive = renew
+
+    def _rebuild(self):
+        self._snapshot = [{"ip": ip, "port": port} for ip, port in self.leases]
+
+    def _expire(self, now):
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, ip, port = heapq.heappop(heap)
+            if self.leases.get((ip, port)) == expires:
+                del self.leases[(ip, port)]
+                expired.append({"ip": ip, "port": port})
+        if expired:
+            self._rebuild()
+        return expired
+
+    def start(self, peers=()):
+        """
+        Start the expiry thread. ``peers`` (e.g. those already in the store)
+        get one lease period to send their first heartbeat.
+        """
+        for p in peers:
+            self.renew(p.get("ip"), p.get("port"))
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                now = time.monotonic()
+                expired = self._expire(now)
+                if not expired:
+                    timeout = None
+                    if self._heap:
+                        timeout = max(self._heap[0][0] - now, EXPIRY_GRANULARITY)
+                    self._cond.wait(timeout)
+                    continue
+            names = ["{}:{}".format(p["ip"], p["port"]) for p in expired[:5]]
+            if len(expired) > 5:
+                names.append("and {} more".format(len(expired) - 5))
+            print("[Tracker] Lease expired for", ", ".join(names))
+            if self.on_expire:
+                try:
+                    self.on_expire(expired)
+                except Exception as e:
+                    print("[Tracker] Lease expiry callback failed:", e)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
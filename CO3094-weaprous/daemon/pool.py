@@ -0,0 +1,160 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.pool
+~~~~~~~~~~~~~~~~~
+
+This module keeps persistent TCP connections to proxy upstreams so a proxied
+request does not pay a connect (and teardown) per request.
+
+A :class:`ConnectionPool` holds idle sockets for one ``host:port``. Sockets
+are checked before reuse (a peer that closed or sent unsolicited bytes is
+discarded), evicted after ``idle_timeout`` seconds, and at most ``max_size``
+of them are kept.
+"""
+
+import select
+import socket
+import threading
+import time
+
+#: Idle connections kept per upstream.
+POOL_MAX_SIZE = 16
+
+#: Seconds an idle pooled connection may be reused. Keep this below the
+#: backend keep-alive timeout (see ``httpadapter.KEEPALIVE_TIMEOUT``).
+POOL_IDLE_TIMEOUT = 4
+
+#: Seconds allowed to establish a new upstream connection.
+CONNECT_TIMEOUT = 5
+
+
+def is_alive(sock):
+    """
+    Return ``True`` if an idle socket still looks usable: not closed by the
+    peer and with no unread bytes pending.
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (ValueError, OSError):
+        return False
+    # an idle keep-alive socket should have nothing to read; readable means
+    # EOF (peer closed) or stray bytes, neither of which is safe to reuse
+    return not readable
+
+
+class ConnectionPool:
+    """Pool of persistent connections to a single upstream.
+
+    Usage::
+      >>> pool = ConnectionPool("127.0.0.1", 9000)
+      >>> sock, reused = pool.acquire()
+      >>> ...
+      >>> pool.release(sock, reusable=True)
+    """
+
+    def __init__(self, host, port, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, connect_timeout=CONNECT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = []          # (socket, released_at), most recent last
+        self._lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def acquire(self):
+        """
+        Return ``(sock, reused)``: a healthy idle connection if one is
+        available, otherwise a new one.
+
+        :raise socket.error: if a new connection cannot be established.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                sock, released_at = self._idle.pop()
+            if released_at >= deadline and is_alive(sock):
+                return sock, True
+            self._discard(sock)
+        return self.connect(), False
+
+    def release(self, sock, reusable=True):
+        """Return ``sock`` to the pool, or close it if it cannot be reused."""
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((sock, time.monotonic()))
+                    return
+        self._discard(sock)
+
+    def evict_idle(self):
+        """Close connections that have been idle longer than ``idle_timeout``."""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            stale = [s for s, t in self._idle if t < deadline]
+            self._idle = [(s, t) for s, t in self._idle if t >= deadline]
+        for sock in stale:
+            self._discard(sock)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            self._discard(sock)
+
+    def _discard(self, sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+class PoolManager:
+    """Registry of one :class:`ConnectionPool` per upstream ``(host, port)``.
+
+    A background thread evicts idle connections every ``idle_timeout``.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.pools = {}
+        self._lock = threading.Lock()
+
+        reaper = threading.Thread(target=self._reap, daemon=True)
+        reaper.start()
+
+    def get(self, host, port):
+        key = (host, port)
+        with self._lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(host, port, self.max_size, self.idle_timeout)
+                self.pools[key] = pool
+            return pool
+
+    def _reap(self):
+        while True:
+            time.sleep(self.idle_timeout)
+            with self._lock:
+                pools = list(self.pools.values())
+            for pool in pools:
+                pool.evict_idle()
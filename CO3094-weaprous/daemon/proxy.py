@@ -19,11 +19,19 @@ It routes incoming HTTP requests to backend services based on hostname mappings
 the corresponding responses to clients.
 """
 
+import selectors
 import socket
+import sys
 import threading
 from .response import *
-from .httpadapter import HttpAdapter
+from .httpadapter import HttpAdapter, KEEPALIVE_TIMEOUT
+from .request import HttpParser, HttpParseError
 from .dictionary import CaseInsensitiveDict
+from .eventloop import serve
+from .pool import PoolManager, POOL_MAX_SIZE
+from .balancer import Balancer
+from .health import HealthChecker, CHECK_INTERVAL, MAX_FAILS
+from .request import Request
 
 
 # Fallback mapping (not used when proxy.conf is parsed)
@@ -34,89 +42,417 @@ PROXY_PASS = {
 }
 
 
+class UpstreamUnavailable(Exception):
+    """The upstream could not be reached or closed before responding.
+
+    Raised before any response byte was sent to the client, so the request
+    can be retried on another upstream or answered with ``502``.
+    """
+
+
+#: Size of the reusable relay buffer used by the streaming mode.
+RELAY_BUFSIZE = 64 * 1024
+
+#: Seconds without traffic in either direction before a relay is dropped.
+RELAY_IDLE_TIMEOUT = 60
+
+#: Request bodies up to this size are buffered whole by the event loop
+#: before forwarding; larger ones are streamed from a worker.
+LOOP_BUFFER_BODY = 64 * 1024
+
+
+def pipe(client, backend, upload=None, timeout=RELAY_IDLE_TIMEOUT):
+    """
+    Relay bytes between ``client`` and ``backend`` in both directions as they
+    arrive, through one reusable buffer (``recv_into`` + ``memoryview``, no
+    per-chunk allocation).
+
+    :param upload (int): Request body bytes still expected from the client.
+        ``None`` relays the client side until EOF (tunnel mode).
+    :rtype int: Number of response bytes sent to the client. The relay ends
+        when the backend closes, or when either side closes in tunnel mode.
+    """
+    buf = bytearray(RELAY_BUFSIZE)
+    view = memoryview(buf)
+    sent = 0
+
+    sel = selectors.DefaultSelector()
+    sel.register(backend, selectors.EVENT_READ, client)
+    if upload is None or upload > 0:
+        sel.register(client, selectors.EVENT_READ, backend)
+
+    try:
+        while True:
+            events = sel.select(timeout)
+            if not events:
+                return sent
+            for key, _ in events:
+                src, dst = key.fileobj, key.data
+                want = len(buf)
+                if src is client and upload is not None:
+                    want = min(want, upload)
+                n = src.recv_into(view, want)
+                if not n:
+                    return sent
+                dst.sendall(view[:n])
+                if src is backend:
+                    sent += n
+                elif upload is not None:
+                    upload -= n
+                    if upload == 0:
+                        sel.unregister(client)
+    finally:
+        sel.close()
+
+
+def stream_request(host, port, head, body, client, upload=0):
+    """
+    Send ``head`` and the buffered ``body`` prefix to the backend, then
+    stream the rest of the request body and the response through :func:`pipe`
+    so the client sees the first response bytes as soon as they arrive.
+
+    :rtype int: Number of response bytes relayed to the client.
+    :raise UpstreamUnavailable: if the backend cannot be reached.
+    """
+    try:
+        backend = socket.create_connection((host, port), timeout=RELAY_IDLE_TIMEOUT)
+    except socket.error as e:
+        raise UpstreamUnavailable(e)
+
+    try:
+        backend.sendall(head + body)
+        return pipe(client, backend, upload)
+    except socket.error as e:
+        print("[Proxy] Relay error:", e)
+        return 0
+    finally:
+        backend.close()
+
+
+def relay(src, dst, remaining, buf):
+    """
+    Copy exactly ``remaining`` bytes from ``src`` to ``dst`` through the
+    reusable buffer ``buf``. Returns ``False`` if ``src`` closed early.
+    """
+    view = memoryview(buf)
+    while remaining > 0:
+        n = src.recv_into(view, min(len(buf), remaining))
+        if not n:
+            return False
+        dst.sendall(view[:n])
+        remaining -= n
+    return True
+
+
+def _fill(src, data):
+    chunk = src.recv(RELAY_BUFSIZE)
+    if not chunk:
+        return False
+    data += chunk
+    return True
+
+
+def relay_chunked(src, dst, data, buf):
+    """
+    Forward a ``Transfer-Encoding: chunked`` body verbatim, tracking chunk
+    sizes only to find where it ends. ``data`` holds bytes already read past
+    the header block. Chunk payloads are relayed without being buffered.
+
+    :rtype bool: ``True`` if the body ended cleanly with nothing left over.
+    """
+    data = bytearray(data)
+    while True:
+        eol = data.find(b"\r\n")
+        while eol < 0:
+            if not _fill(src, data):
+                return False
+            eol = data.find(b"\r\n")
+        try:
+            size = int(bytes(data[:eol]).split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            return False
+
+        if size == 0:
+            # last chunk, then optional trailers and an empty line
+            while True:
+                if data[eol + 2:eol + 4] == b"\r\n":
+                    end = eol + 4
+                    break
+                trailer_end = data.find(b"\r\n\r\n", eol)
+                if trailer_end >= 0:
+                    end = trailer_end + 4
+                    break
+                if not _fill(src, data):
+                    return False
+            dst.sendall(data[:end])
+            return len(data) == end
+
+        frame = eol + 2 + size + 2
+        if len(data) >= frame:
+            dst.sendall(data[:frame])
+            del data[:frame]
+            continue
+        dst.sendall(data)
+        rest = frame - len(data)
+        data = bytearray()
+        if not relay(src, dst, rest, buf):
+            return False
+
+
+def _status_line(head):
+    try:
+        version, status = head.split(b" ", 2)[:2]
+        return version, int(status)
+    except ValueError:
+        raise HttpParseError(502, "Bad Gateway")
+
+
+def _relay_response(parser, head, method, backend, client):
+    """
+    Relay one framed response from a pooled ``backend`` to ``client``.
+
+    Interim ``1xx`` responses (``100 Continue``) are forwarded as they are
+    and the final response is read after them. A ``101 Switching
+    Protocols`` hands both sockets to :func:`pipe` in tunnel mode; the
+    upgraded connection is never pooled.
+
+    :rtype bool: ``True`` if the backend connection can go back to the pool.
+    """
+    version, status = _status_line(head)
+    while 100 <= status < 200:
+        client.sendall(head)
+        parser.take_head(bodyless=True)
+        if status == 101:
+            if parser.pending():
+                client.sendall(bytes(parser.buffer))
+                parser.buffer.clear()
+            pipe(client, backend)
+            return False
+        head = parser.read_head(backend)
+        if head is None:
+            return False
+        version, status = _status_line(head)
+
+    headers = parser.headers
+    keep = version == b"HTTP/1.1" and b"close" not in headers.get(b"connection", b"").lower()
+    no_body = method == b"HEAD" or status in (204, 304)
+
+    # the client side is closed after one response
+    client.sendall(rewrite_header(head, "Connection", "close"))
+    buf = bytearray(RELAY_BUFSIZE)
+
+    if no_body:
+        parser.take_head(bodyless=True)
+        return keep and not parser.pending()
+
+    chunked = parser.chunked
+    _, prefix, remaining = parser.take_head()
+    if chunked:
+        return relay_chunked(backend, client, prefix, buf) and keep
+
+    if prefix:
+        client.sendall(prefix)
+    if remaining is None:
+        # no framing: the body runs until the backend closes
+        view = memoryview(buf)
+        while True:
+            n = backend.recv_into(view)
+            if not n:
+                return False
+            client.sendall(view[:n])
+
+    return relay(backend, client, remaining, buf) and keep
+
+
+def pooled_request(pools, host, port, head, body, client, upload=0):
+    """
+    Forward one request over a persistent upstream connection taken from
+    ``pools`` and relay the response. The connection is returned to the
+    pool when both the request and a length-framed keep-alive response were
+    transferred completely.
+
+    A reused connection that turns out to be closed by the backend before
+    any response byte is retried once on a fresh connection, when the whole
+    request body is still in hand.
+
+    :raise UpstreamUnavailable: if the backend cannot be reached or closes
+        before sending a response.
+    """
+    pool = pools.get(host, port)
+    method = head.split(b" ", 1)[0].upper()
+    request = rewrite_header(head, "Connection", "keep-alive") + body
+
+    for attempt in range(2):
+        try:
+            if attempt == 0:
+                backend, reused = pool.acquire()
+            else:
+                # not another idle one, which may be just as stale
+                backend, reused = pool.connect(), False
+        except socket.error as e:
+            raise UpstreamUnavailable(e)
+
+        reusable = False
+        started = False
+        try:
+            backend.settimeout(RELAY_IDLE_TIMEOUT)
+            backend.sendall(request)
+            if upload and not relay(client, backend, upload, bytearray(RELAY_BUFSIZE)):
+                return False
+
+            parser = HttpParser(max_body_size=sys.maxsize, response=True)
+            resp_head = parser.read_head(backend)
+            if resp_head is None:
+                if reused and not upload and attempt == 0:
+                    continue
+                raise UpstreamUnavailable("closed before responding")
+
+            started = True
+            reusable = _relay_response(parser, resp_head, method, backend, client)
+            return True
+        except HttpParseError as e:
+            print("[Proxy] Bad upstream response:", e)
+            return False
+        except socket.error as e:
+            if started:
+                print("[Proxy] Relay error:", e)
+                return False
+            if reused and not upload and attempt == 0:
+                continue
+            raise UpstreamUnavailable(e)
+        finally:
+            pool.release(backend, reusable)
+    return False
+
+
 def forward_request(host, port, request):
     """
     Forward raw HTTP request bytes to backend server.
+
+    :raise UpstreamUnavailable: if the backend cannot be reached.
     """
     backend = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
     try:
         backend.connect((host, port))
-        backend.sendall(request.encode())
+    except socket.error as e:
+        backend.close()
+        raise UpstreamUnavailable(e)
+
+    try:
+        if isinstance(request, str):
+            request = request.encode()
+        backend.sendall(request)
 
-        response = b""
+        response = bytearray()
         while True:
             chunk = backend.recv(4096)
             if not chunk:
                 break
             response += chunk
 
-        return response
+        return bytes(response)
 
     except socket.error as e:
         print("[Proxy] Socket error:", e)
-        return (
-            "HTTP/1.1 404 Not Found\r\n"
-            "Content-Type: text/plain\r\n"
-            "Content-Length: 13\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-            "404 Not Found"
-        ).encode('utf-8')
+        return forward_error()
+    finally:
+        backend.close()
 
 
-def resolve_routing_policy(hostname, routes):
+def forward_error():
+    return (
+        "HTTP/1.1 502 Bad Gateway\r\n"
+        "Content-Type: text/plain\r\n"
+        "Content-Length: 11\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+        "Bad Gateway"
+    ).encode('utf-8')
+
+
+def rewrite_header(head, name, value):
     """
-    Determine correct backend according to parsed proxy.conf rules.
+    Return the header block ``head`` (bytes) with header ``name`` replaced by
+    ``value`` (or removed when ``value`` is None).
     """
+    key = name.lower().encode() + b":"
+    lines = head[:-4].split(b"\r\n")
+    lines = [lines[0]] + [ln for ln in lines[1:] if not ln.lower().startswith(key)]
+    if value is not None:
+        lines.append("{}: {}".format(name, value).encode())
+    return b"\r\n".join(lines) + b"\r\n\r\n"
 
-    # Default fallback (never allow crash)
-    proxy_map, policy = routes.get(hostname, ("127.0.0.1:9000", "round-robin"))
 
-    print("[Proxy] Routing host:", hostname)
-    print("[Proxy] Proxy map:", proxy_map)
-    print("[Proxy] Policy:", policy)
+def resolve_routing_policy(hostname, balancer, client_ip=None, cookies=None):
+    """
+    Determine correct backend according to parsed proxy.conf rules.
 
-    # Multiple proxy_pass
-    if isinstance(proxy_map, list):
-        if len(proxy_map) == 0:
-            print("[Proxy] No routes configured. Using fallback 127.0.0.1:9000")
-            return "127.0.0.1", "9000"
+    ``balancer`` is the proxy's shared :class:`Balancer`, which keeps the
+    policy state (round-robin position, in-flight counts) across requests.
 
-        elif len(proxy_map) == 1:
-            # Single backend
-            host, port = proxy_map[0].split(":")
-            return host, port
+    :rtype: (UpstreamGroup, Upstream) - the host's group and the chosen
+        member, or ``None`` when no upstream is available.
+    """
+    group = balancer.group(hostname)
+    member = group.choose(client_ip, cookies)
 
-        else:
-            # Multi-backend (round-robin default)
-            # simple: always pick first — you can extend later
-            host, port = proxy_map[0].split(":")
-            return host, port
+    print("[Proxy] Routing host:", hostname)
+    print("[Proxy] Policy:", group.policy, "->", member.address if member else None)
 
-    # Single string proxy_pass
-    else:
-        host, port = proxy_map.split(":")
-        return host, port
+    return group, member
 
 
-def handle_client(ip, port, conn, addr, routes):
+def handle_client(ip, port, conn, addr, routes, stream=True, pools=None, parser=None):
     """
     Handle a single incoming client to the proxy.
+
+    In streaming mode only the request head is parsed up front; a
+    ``Content-Length`` body and the response are relayed as they arrive.
+    Chunked request bodies, and the buffered mode, read the whole request
+    before forwarding. With ``pools`` (a :class:`PoolManager`) streamed
+    requests reuse persistent upstream connections. ``parser`` holds bytes
+    already read from ``conn`` (see :func:`proxy_session`). ``routes`` is
+    the shared :class:`Balancer` built by :func:`run_proxy`.
     """
 
+    parser = parser or HttpParser()
+    upload = 0
     try:
-        request = conn.recv(1024).decode()
-    except:
+        if parser.message_ready():
+            # already buffered whole, e.g. by the event loop
+            msg = parser.parse()
+        elif parser.read_head(conn) is None:
+            msg = None
+        elif stream and not parser.chunked:
+            head, body, upload = parser.take_head()
+            msg = head, body
+        else:
+            msg = parser.read_message(conn)
+    except HttpParseError as e:
+        body = e.reason.encode()
+        conn.sendall((
+            "HTTP/1.1 {} {}\r\n"
+            "Content-Type: text/plain\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        ).format(e.status, e.reason, len(body)).encode() + body)
+        conn.close()
+        return
+    if msg is None:
         conn.close()
         return
 
+    head, body = msg
     hostname = None
+    cookies = {}
 
-    # Parse Host header
-    for line in request.splitlines():
+    # Parse Host and Cookie headers
+    for line in head.decode(errors="ignore").split("\r\n"):
         if line.lower().startswith("host:"):
             hostname = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("cookie:"):
+            cookies = Request().parse_cookies(line.split(":", 1)[1])
 
     print("[Proxy] {} Host={}".format(addr, hostname))
 
@@ -133,26 +469,103 @@ def handle_client(ip, port, conn, addr, routes):
         return
 
     # Resolve backend
-    resolved_host, resolved_port = resolve_routing_policy(hostname, routes)
+    client_ip = addr[0] if addr else None
+    group, member = resolve_routing_policy(hostname, routes, client_ip, cookies)
+    tried = set()
 
-    # Convert port safely
+    # Forward to backend, moving on to the next healthy upstream when one
+    # cannot be reached (only while the whole request is still in hand)
     try:
-        resolved_port = int(resolved_port)
-    except:
-        resolved_port = 9000
+        while member is not None:
+            print("[Proxy] Forwarding → {} ({})".format(member.address, group.policy))
+            try:
+                with group.track(member):
+                    forward(member.host, member.port, head, body, conn, upload, stream, pools)
+                member.health.record_success()
+                return
+            except UpstreamUnavailable as e:
+                print("[Proxy] Upstream {} unavailable: {}".format(member.address, e))
+                member.health.record_failure()
+                tried.add(member)
+                member = None if upload else group.next_candidate(tried, client_ip, cookies)
+
+        print("[Proxy] No upstream available for", hostname)
+        conn.sendall(forward_error())
+    except socket.error as e:
+        print("[Proxy] Client socket error:", e)
+    finally:
+        conn.close()
 
-    print("[Proxy] Forwarding → {}:{}".format(resolved_host, resolved_port))
 
-    # Forward to backend
-    response = forward_request(resolved_host, resolved_port, request)
-    conn.sendall(response)
-    conn.close()
+def forward(host, port, head, body, conn, upload=0, stream=True, pools=None):
+    """
+    Send one parsed request to ``host:port`` and relay the response to
+    ``conn`` using the pooled, streaming or buffered path.
+    """
+    if stream and pools is not None:
+        pooled_request(pools, host, port, head, body, conn, upload)
+        return
+
+    # backends keep connections alive; ask for close so EOF ends the response
+    head = rewrite_header(head, "Connection", "close")
+    if stream:
+        stream_request(host, port, head, body, conn, upload)
+    else:
+        conn.sendall(forward_request(host, port, head + body))
 
 
-def run_proxy(ip, port, routes):
+def proxy_session(ip, port, conn, addr, routes, stream=True, pools=None):
     """
-    Main proxy loop: accepts clients and spawns threads
+    Build the event-loop session of one client connection. The loop feeds
+    the request into the session's parser and starts :func:`handle_client`
+    on a worker only once the whole request is buffered, so a slow client
+    holds no worker. In streaming mode a body over :data:`LOOP_BUFFER_BODY`
+    is the exception: the worker starts after the head and streams it.
     """
+    parser = HttpParser()
+
+    def session():
+        return handle_client(ip, port, conn, addr, routes, stream, pools, parser)
+
+    def feed(data):
+        parser.feed(data)
+        if not parser.head_ready():
+            return False
+        if stream and not parser.chunked:
+            try:
+                length = int(parser.headers.get(b"content-length", b"0"))
+            except ValueError:
+                return True          # handle_client answers the bad request
+            if length > LOOP_BUFFER_BODY:
+                return True
+        return parser.message_ready()
+
+    session.feed = feed
+    return session
+
+
+def run_proxy(ip, port, routes, event_loop=False, stream=True, pool_size=POOL_MAX_SIZE,
+              health_check="tcp", health_interval=CHECK_INTERVAL, max_fails=MAX_FAILS):
+    """
+    Main proxy loop: accepts clients and spawns threads, or hands them to
+    the shared selectors loop when ``event_loop`` is set.
+
+    ``pool_size`` idle connections are kept per upstream; 0 disables pooling.
+    ``health_check`` is ``"tcp"``, ``"http:<path>"`` or ``None`` to only
+    eject upstreams passively after ``max_fails`` consecutive errors.
+    """
+    pools = PoolManager(max_size=pool_size) if pool_size > 0 else None
+    if not isinstance(routes, Balancer):
+        routes = Balancer(routes, max_fails=max_fails)
+    if health_check:
+        HealthChecker(routes, health_check, health_interval).start()
+
+    if event_loop:
+        serve(ip, port,
+              lambda conn, addr: proxy_session(ip, port, conn, addr, routes, stream, pools),
+              name="Proxy", idle_timeout=KEEPALIVE_TIMEOUT)
+        return
+
     proxy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     try:
@@ -164,7 +577,7 @@ def run_proxy(ip, port, routes):
             conn, addr = proxy.accept()
             thread = threading.Thread(
                 target=handle_client,
-                args=(ip, port, conn, addr, routes)
+                args=(ip, port, conn, addr, routes, stream, pools)
             )
             thread.daemon = True
             thread.start()
@@ -173,5 +586,7 @@ def run_proxy(ip, port, routes):
         print("[Proxy] Socket error:", e)
 
 
-def create_proxy(ip, port, routes):
-    run_proxy(ip, port, routes)
+def create_proxy(ip, port, routes, event_loop=False, stream=True, pool_size=POOL_MAX_SIZE,
+                 health_check="tcp", health_interval=CHECK_INTERVAL, max_fails=MAX_FAILS):
+    run_proxy(ip, port, routes, event_loop, stream, pool_size,
+              health_check, health_interval, max_fails)
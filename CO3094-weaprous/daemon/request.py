@@ -1,7 +1,333 @@
+import re
+import socket
 import urllib
+from urllib.parse import parse_qsl
+
+from .router import find_route
+
+#: Largest accepted request line + headers block, in bytes.
+MAX_HEADER_SIZE = 64 * 1024
+
+#: Largest accepted (decoded) request body, in bytes.
+MAX_BODY_SIZE = 8 * 1024 * 1024
+
+_HEX = re.compile(rb"[0-9A-Fa-f]+")
+
+
+class HttpParseError(Exception):
+    """Raised by :class:`HttpParser` when a message is malformed or too large.
+
+    :attr status (int): HTTP status code to answer with.
+    :attr reason (str): Matching reason phrase.
+    """
+
+    def __init__(self, status, reason):
+        Exception.__init__(self, "{} {}".format(status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class HttpParser:
+    """Incremental, bounded HTTP/1.x message reader.
+
+    Bytes are accumulated in a single ``bytearray`` and scanned only from
+    where the previous call stopped, so a message split over many TCP
+    segments costs O(n). The header block is read up to the blank line and
+    the body is framed by ``Content-Length`` or decoded from
+    ``Transfer-Encoding: chunked``. Bytes after a complete message stay
+    buffered for the next (pipelined) one.
+
+    Usage::
+      >>> parser = HttpParser()
+      >>> msg = parser.read_message(conn)
+      >>> if msg:
+      >>>     head, body = msg
+    """
+
+    def __init__(self, max_header_size=MAX_HEADER_SIZE, max_body_size=MAX_BODY_SIZE,
+                 response=False):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        # a response without Content-Length or chunking runs until close
+        self.response = response
+        self.buffer = bytearray()
+        self._ready = None        # message parsed ahead by message_ready()
+        self._error = None        # HttpParseError found ahead of the reader
+        self._reset()
+
+    def _reset(self):
+        self._scan_from = 0
+        self._head_end = -1
+        self._headers = None
+        self._length = None
+        self._chunked = False
+        self._chunk_pos = 0
+        self._body = None
+
+    def pending(self):
+        """Return ``True`` if unparsed bytes or a parsed message are buffered."""
+        return self._ready is not None or len(self.buffer) > 0
+
+    def head_ready(self):
+        """
+        Return ``True`` once the header block is buffered (or known to be
+        malformed; the error is raised to the reader), without consuming it.
+        Lets an event loop wait for a request head without blocking.
+        """
+        if self._ready is not None or self._error is not None:
+            return True
+        try:
+            return self._parse_head_block()
+        except HttpParseError as e:
+            self._error = e
+            return True
+
+    def message_ready(self):
+        """
+        Return ``True`` once a complete message is buffered (or known to be
+        malformed). The message is parsed here and handed out by the next
+        :meth:`parse` or :meth:`read_message`.
+        """
+        if self._ready is None and self._error is None:
+            try:
+                self._ready = self._parse()
+            except HttpParseError as e:
+                self._error = e
+        return self._ready is not None or self._error is not None
+
+    def feed(self, data):
+        self.buffer += data
+
+    def _recv(self, sock, bufsize):
+        try:
+            chunk = sock.recv(bufsize)
+        except (socket.timeout, OSError):
+            return False
+        if not chunk:
+            return False
+        self.feed(chunk)
+        return True
+
+    def read_message(self, sock, bufsize=8192):
+        """
+        Return the next ``(head, body)`` pair read from ``sock``, or ``None``
+        on EOF, timeout or socket error before a complete message.
+
+        :raise HttpParseError: if the message is malformed or exceeds limits.
+        """
+        msg = self.parse()
+        while msg is None:
+            if not self._recv(sock, bufsize):
+                return None
+            msg = self.parse()
+        return msg
+
+    def read_head(self, sock, bufsize=8192):
+        """
+        Read until the header block is complete without waiting for the
+        body. Returns the head bytes, or ``None`` on EOF/timeout.
+
+        Follow with :meth:`read_message` to buffer the body, or with
+        :meth:`take_head` to stream it.
+        """
+        while not self._parse_head_block():
+            if not self._recv(sock, bufsize):
+                return None
+        return bytes(self.buffer[:self._head_end])
+
+    @property
+    def chunked(self):
+        return self._chunked
+
+    @property
+    def headers(self):
+        """Parsed headers of the current message (lower-cased bytes keys)."""
+        return self._headers or {}
+
+    def take_head(self, bodyless=False):
+        """
+        Consume a parsed header block and whatever body bytes are already
+        buffered.
+
+        :param bodyless (bool): The message has no body whatever its headers
+            say (a ``1xx``, ``204`` or ``304`` response, or one to ``HEAD``),
+            so only the header block is consumed.
+        :rtype: (bytes, bytes, int) - head, buffered body prefix and number
+            of body bytes still to be read from the socket. ``None`` when
+            the body is not length-delimited (chunked, or until close); the
+            prefix is then everything buffered.
+        """
+        buf = self.buffer
+        head = bytes(buf[:self._head_end])
+        if bodyless:
+            end = self._head_end
+            prefix, remaining = b"", 0
+            del buf[:end]
+            self._reset()
+            return head, prefix, remaining
+        if self._length is None:
+            prefix = bytes(buf[self._head_end:])
+            remaining = None
+            end = len(buf)
+        else:
+            end = min(len(buf), self._head_end + self._length)
+            prefix = bytes(buf[self._head_end:end])
+            remaining = self._length - len(prefix)
+        del buf[:end]
+        self._reset()
+        return head, prefix, remaining
+
+    def _parse_head_block(self):
+        if self._error is not None:
+            raise self._error
+        if self._head_end >= 0:
+            return True
+        buf = self.buffer
+        end = buf.find(b"\r\n\r\n", self._scan_from)
+        if end < 0:
+            if len(buf) > self.max_header_size:
+                raise HttpParseError(431, "Request Header Fields Too Large")
+            self._scan_from = max(0, len(buf) - 3)
+            return False
+        if end + 4 > self.max_header_size:
+            raise HttpParseError(431, "Request Header Fields Too Large")
+        self._head_end = end + 4
+        self._parse_head(bytes(buf[:end]))
+        return True
+
+    def parse(self):
+        """
+        Try to extract one complete message from the buffer.
+
+        :rtype: (bytes, bytes) or None - the header block (ending with a
+            blank line) and the decoded body. Chunked messages are returned
+            with ``Content-Length`` in place of ``Transfer-Encoding``.
+        """
+        if self._ready is not None:
+            msg, self._ready = self._ready, None
+            return msg
+        return self._parse()
+
+    def _parse(self):
+        if not self._parse_head_block():
+            return None
+
+        if self._chunked:
+            return self._parse_chunked()
+        if self._length is None:
+            return None
+
+        buf = self.buffer
+        total = self._head_end + self._length
+        if len(buf) < total:
+            return None
+        head = bytes(buf[:self._head_end])
+        body = bytes(buf[self._head_end:total])
+        del buf[:total]
+        self._reset()
+        return head, body
+
+    def _parse_head(self, head):
+        headers = {}
+        lengths = set()
+        for line in head.split(b"\r\n")[1:]:
+            if b":" in line:
+                k, v = line.split(b":", 1)
+                k = k.strip().lower()
+                headers[k] = v.strip()
+                if k == b"content-length":
+                    lengths.update(x.strip() for x in v.split(b","))
+        self._headers = headers
+
+        # conflicting framing is how requests get smuggled past a proxy:
+        # differing Content-Lengths, or one next to chunked
+        if len(lengths) > 1:
+            raise HttpParseError(400, "Bad Request")
+        if lengths:
+            headers[b"content-length"] = lengths.pop()
+
+        te = headers.get(b"transfer-encoding", b"").lower()
+        if b"chunked" in te:
+            if b"content-length" in headers:
+                raise HttpParseError(400, "Bad Request")
+            self._chunked = True
+            self._chunk_pos = self._head_end
+            self._body = bytearray()
+            return
+
+        if self.response and b"content-length" not in headers:
+            self._length = None
+            return
+
+        try:
+            length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            raise HttpParseError(400, "Bad Request")
+        if length < 0:
+            raise HttpParseError(400, "Bad Request")
+        if length > self.max_body_size:
+            raise HttpParseError(413, "Payload Too Large")
+        self._length = length
+
+    def _parse_chunked(self):
+        buf = self.buffer
+        pos = self._chunk_pos
+        while True:
+            eol = buf.find(b"\r\n", pos)
+            if eol < 0:
+                if len(buf) - pos > self.max_header_size:
+                    raise HttpParseError(400, "Bad Request")
+                return None
+            if eol - pos > self.max_header_size:
+                raise HttpParseError(400, "Bad Request")
+            size_field = bytes(buf[pos:eol]).split(b";", 1)[0].strip()
+            if not _HEX.fullmatch(size_field):
+                raise HttpParseError(400, "Bad Request")
+            size = int(size_field, 16)
+
+            if size == 0:
+                # optional trailers, terminated by an empty line
+                if buf[eol + 2:eol + 4] == b"\r\n":
+                    end = eol + 4
+                else:
+                    trailer_end = buf.find(b"\r\n\r\n", eol + 2)
+                    if trailer_end < 0:
+                        if len(buf) - eol > self.max_header_size:
+                            raise HttpParseError(431, "Request Header Fields Too Large")
+                        self._chunk_pos = pos
+                        return None
+                    if trailer_end - eol > self.max_header_size:
+                        raise HttpParseError(431, "Request Header Fields Too Large")
+                    end = trailer_end + 4
+                break
+
+            if len(self._body) + size > self.max_body_size:
+                raise HttpParseError(413, "Payload Too Large")
+            data_end = eol + 2 + size
+            if len(buf) < data_end + 2:
+                self._chunk_pos = pos
+                return None
+            # chunk data must end exactly at its CRLF; anything else means
+            # the framing cannot be trusted (request smuggling)
+            if buf[data_end:data_end + 2] != b"\r\n":
+                raise HttpParseError(400, "Bad Request")
+            self._body += buf[eol + 2:data_end]
+            pos = data_end + 2
+            self._chunk_pos = pos
+
+        lines = [ln for ln in bytes(buf[:self._head_end - 4]).split(b"\r\n")
+                 if not ln.lower().startswith((b"transfer-encoding:", b"content-length:"))]
+        lines.append(b"Content-Length: " + str(len(self._body)).encode())
+        head = b"\r\n".join(lines) + b"\r\n\r\n"
+        body = bytes(self._body)
+        del buf[:end]
+        self._reset()
+        return head, body
+
 
 class Request:
-    __attrs__=["method","url","headers","body","reason","cookies","routes","hook","path","version"]
+    __attrs__=["method","url","headers","body","reason","cookies","routes","hook","path","version","query",
+               "params","allowed"]
 
     def __init__(self):
         self.method=None
@@ -12,12 +338,21 @@ class Request:
         self.body=""
         self.routes={}
         self.hook=None
+        # path parameters of the matched route, and the methods the path
+        # allows when it only matched under another one
+        self.params={}
+        self.allowed=None
         self.version="HTTP/1.1"
+        self.query_string=""
+        self.query={}
 
     def extract_request_line(self, raw):
         try:
             line=raw.splitlines()[0]
             m,p,v=line.split()
+            # routes and static files are matched without the query string
+            self.url=p
+            p,_,self.query_string=p.partition("?")
             if p=="/":
                 p="/index.html"
             elif p == "/login":
@@ -35,6 +370,9 @@ class Request:
                 h[k.lower()]=v
         return h
 
+    def parse_query(self, qs):
+        return dict(parse_qsl(qs or "", keep_blank_values=True))
+
     def parse_cookies(self, c):
         out={}
         if not c:
@@ -49,12 +387,13 @@ class Request:
     def prepare(self, raw, routes=None):
         m, p, v = self.extract_request_line(raw)
         self.method = m
-        self.path = p.strip()
+        self.path = p.strip() if p else None
         self.version = v
         self.headers = self.prepare_headers(raw)
         self.body = raw.split("\r\n\r\n",1)[1] if "\r\n\r\n" in raw else ""
         self.cookies = self.parse_cookies(self.headers.get("cookie",""))
-        if routes:
+        self.query = self.parse_query(self.query_string)
+        if routes and self.path:
             self.routes = routes
-            self.hook = routes.get((self.method,self.path))
+            self.hook, self.params, self.allowed = find_route(routes, self.method, self.path)
         return self
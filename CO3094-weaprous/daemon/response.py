@@ -18,16 +18,40 @@ This module provides a :class: `Response <Response>` object to manage and persis
 response settings (cookies, auth, proxies), and to construct HTTP responses
 based on incoming requests. 
 
-The current version supports MIME type detection, content loading and header formatting
+The current version supports MIME type detection, content loading and header formatting.
+Static files are served from a shared in-memory :class:`FileCache
+<daemon.filecache.FileCache>`. Their body is left in :attr:`Response.payload`
+(a view of the cached bytes, or a :class:`FileRange` to stream from disk) for
+the adapter to write after the header, so it is never copied per request.
 """
 import datetime
 import os
 import mimetypes
+from collections import namedtuple
+from email.utils import formatdate, parsedate_to_datetime
+from .compress import accepted_encoding, is_compressible
 from .dictionary import CaseInsensitiveDict
+from .filecache import FileCache
 
 # Base directory: parent folder of this file → project root
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/"
 
+#: Static files shared by every :class:`Response`.
+STATIC_CACHE = FileCache()
+
+#: ``Cache-Control`` max-age in seconds per top-level directory of
+#: :data:`BASE_DIR`; 0 sends ``no-cache`` (browsers revalidate every time
+#: and get a ``304`` while the file is unchanged). Directories not listed
+#: send no ``Cache-Control``.
+CACHE_MAX_AGE = {
+    "static": 600,
+    "www": 0,
+}
+
+#: Part of a file to send with ``socket.sendfile``.
+FileRange = namedtuple("FileRange", "path offset count")
+
+
 class Response:
     __attrs__ = [
         "_content",
@@ -43,6 +67,7 @@ class Response:
         "elapsed",
         "request",
         "body",
+        "payload",
     ]
 
     def __init__(self, request=None):
@@ -60,6 +85,8 @@ class Response:
         self.cookies = CaseInsensitiveDict()
         self.elapsed = datetime.timedelta(0)
         self.request = request
+        # body written after what build_response returns, if any
+        self.payload = None
 
     def get_mime_type(self, path):
         try:
@@ -70,7 +97,6 @@ class Response:
 
     def prepare_content_type(self, mime_type='text/html'):
         main_type, sub_type = mime_type.split('/', 1)
-        print(f"[Response] MIME main={main_type} sub={sub_type}")
 
         # HTML
         if main_type == "text" and sub_type == "html":
@@ -98,10 +124,7 @@ class Response:
     def build_content(self, path, base_dir):
         filepath = os.path.join(base_dir, path)
 
-        print(f"[Response] serving file {filepath}")
-
         if not os.path.exists(filepath):
-            print("[Response] FILE NOT FOUND:", filepath)
             return 0, b""
 
         try:
@@ -120,7 +143,7 @@ class Response:
 
         # Required headers
         self.headers.setdefault("Content-Length", str(len(self._content)))
-        self.headers.setdefault("Date", datetime.datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT"))
+        self.headers.setdefault("Date", formatdate(usegmt=True))
         self.headers.setdefault("Server", "WeaprousHTTP/1.0")
 
         # Convert header dict → HTTP string
@@ -135,15 +158,13 @@ class Response:
         return header_bytes
 
     def build_notfound(self):
-        html = (
-            "HTTP/1.1 404 Not Found\r\n"
-            "Content-Type: text/html\r\n"
-            "Content-Length: 13\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-            "404 Not Found"
-        )
-        return html.encode("utf-8")
+        self.status_code = 404
+        self.reason = "Not Found"
+        self._content = b"404 Not Found"
+        self.headers["Content-Type"] = "text/html"
+        self.headers["Content-Length"] = str(len(self._content))
+        self.headers.setdefault("Connection", "close")
+        return self.build_response_header(self.request) + self._content
 
     def _resolve_path_and_mime(self, path):
         """
@@ -183,23 +204,149 @@ class Response:
 
         return base_dir, normalized, mime_type
 
+    def build_static_header(self, entry, with_body=True):
+        """
+        Build the response header of a :class:`CachedFile
+        <daemon.filecache.CachedFile>`, reusing its prebuilt
+        ``Content-Type``/``Content-Length`` lines unless there is no body.
+        """
+        self.headers.setdefault("Date", formatdate(usegmt=True))
+        self.headers.setdefault("Server", "WeaprousHTTP/1.0")
+        lines = [f"HTTP/1.1 {self.status_code} {self.reason}"]
+        for key, value in self.headers.items():
+            lines.append(f"{key}: {value}")
+        lines.append("")
+        head = "\r\n".join(lines).encode("utf-8")
+        return head + (entry.header if with_body else b"") + b"\r\n"
+
+    def cache_control(self, base_dir):
+        """Return the ``Cache-Control`` value for files under ``base_dir``."""
+        top = os.path.relpath(base_dir, BASE_DIR).split(os.sep)[0]
+        max_age = CACHE_MAX_AGE.get(top)
+        if max_age is None:
+            return None
+        return f"public, max-age={max_age}" if max_age > 0 else "no-cache"
+
+    def is_not_modified(self, request, entry, etag=None):
+        """
+        Evaluate ``If-None-Match`` (or, without it, ``If-Modified-Since``)
+        of ``request`` against ``entry``, or ``etag`` when sending an
+        encoded variant of it.
+        """
+        etag = etag or entry.etag
+        headers = request.headers or {}
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # weak comparison, as for any GET
+            tags = [t.strip() for t in if_none_match.split(",")]
+            return any((t[2:] if t.startswith("W/") else t) == etag for t in tags)
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return entry.mtime // 1_000_000_000 <= since
+        return False
+
+    def parse_range(self, request, entry):
+        """
+        Return the ``(start, end)`` byte range (inclusive) asked for by the
+        ``Range`` header of ``request``, ``None`` to send the whole file, or
+        ``False`` if the range cannot be satisfied. Only single ranges are
+        honoured; an ``If-Range`` that does not match sends the whole file.
+        """
+        headers = request.headers or {}
+        value = (headers.get("range") or "").strip()
+        if not value.startswith("bytes=") or "," in value:
+            return None
+        if_range = headers.get("if-range")
+        if if_range and if_range.strip() not in (entry.etag, entry.last_modified):
+            return None
+        first, _, last = value[len("bytes="):].strip().partition("-")
+        size = entry.size
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+                end = size - 1
+        except ValueError:
+            return None
+        if start > end and last and first:
+            return None
+        if start >= size:
+            return False
+        return start, min(end, size - 1)
+
     def build_response(self, request):
         path = request.path
         # Resolve where the file lives and mime -type
         base_dir, rel_path, mime_type = self._resolve_path_and_mime(path)
 
-        print(f"[Response] {request.method} {path} -> base={base_dir} rel={rel_path} MIME={mime_type}")
+        # Files outside the served directory (e.g. "/css/../../db/x") are
+        # not found
+        filepath = os.path.realpath(os.path.join(base_dir, rel_path))
+        if not filepath.startswith(os.path.realpath(base_dir) + os.sep):
+            return self.build_notfound()
 
-        # Load file
-        size, content = self.build_content(rel_path, base_dir)
-        if size == 0:
+        entry = STATIC_CACHE.get(filepath, mime_type)
+        if entry is None:
             return self.build_notfound()
 
-        self._content = content
-        # Ensure content-length and content-type are set
-        self.headers["Content-Length"] = str(size)
-        self.headers["Content-Type"] = mime_type
+        # Ranges are served from the identity encoding only
+        byte_range = self.parse_range(request, entry)
+        encoding = body = None
+        if byte_range is None and entry.content is not None and is_compressible(mime_type):
+            self.headers["Vary"] = "Accept-Encoding"
+            encoding = accepted_encoding((request.headers or {}).get("accept-encoding"))
+            if encoding:
+                body = STATIC_CACHE.encoded(entry, encoding)
+        # each encoding is its own representation, with its own ETag
+        etag = entry.etag[:-1] + "-" + encoding + '"' if body else entry.etag
+
+        self.headers["ETag"] = etag
+        self.headers["Last-Modified"] = entry.last_modified
+        self.headers["Accept-Ranges"] = "bytes"
+        cache_control = self.cache_control(base_dir)
+        if cache_control:
+            self.headers["Cache-Control"] = cache_control
+
+        if self.is_not_modified(request, entry, etag):
+            self.status_code = 304
+            self.reason = "Not Modified"
+            self._content = b""
+            return self.build_static_header(entry, with_body=False)
+
+        if body:
+            self.payload = memoryview(body)
+            self.headers["Content-Type"] = mime_type
+            self.headers["Content-Encoding"] = encoding
+            self.headers["Content-Length"] = str(len(body))
+            return self.build_response_header(request)
+
+        if byte_range is False:
+            self.status_code = 416
+            self.reason = "Range Not Satisfiable"
+            self.headers["Content-Range"] = f"bytes */{entry.size}"
+            self.headers["Content-Length"] = "0"
+            return self.build_response_header(request)
+
+        start, end = byte_range or (0, entry.size - 1)
+        count = end - start + 1
+        if entry.content is not None:
+            self.payload = memoryview(entry.content)[start:end + 1]
+        else:
+            self.payload = FileRange(entry.path, start, count)
+        if byte_range is None:
+            return self.build_static_header(entry)
 
-        # Final header + content
-        header = self.build_response_header(request)
-        return header + content
\ No newline at end of file
+        self.status_code = 206
+        self.reason = "Partial Content"
+        self.headers["Content-Type"] = mime_type
+        self.headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+        self.headers["Content-Length"] = str(count)
+        return self.build_response_header(request)
\ No newline at end of file
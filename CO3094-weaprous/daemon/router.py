@@ -0,0 +1,238 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.router
+~~~~~~~~~~~~~~~~~
+
+This module provides the route table of WeApRous applications.
+
+A :class:`Router` is the ``{(METHOD, path): handler}`` dict routes have
+always been, so exact lookups and merging keep working, but its paths may
+hold parameters:
+
+- ``<name>`` or ``<str:name>``: one non-empty path segment
+- ``<int:name>``, ``<float:name>``: one segment converted to that type
+- ``<path:name>``: the rest of the path, slashes included (last only)
+
+Routes are compiled into a tree with one level per path segment: static
+segments are a dict lookup, and parameters are tried after them (int, float,
+then str) and wildcards last, backtracking only when a branch dead-ends.
+A lookup costs one step per segment however many routes there are. A path
+that matches a route under another method is reported with the allowed
+methods so the adapter can answer ``405 Method Not Allowed``.
+
+Usage::
+  >>> routes = Router()
+  >>> routes[("GET", "/channels/<name>/history")] = history
+  >>> routes.match("GET", "/channels/general/history")
+  (<function history>, {'name': 'general'}, None)
+  >>> routes.match("POST", "/channels/general/history")
+  (None, {}, ['GET'])
+"""
+
+from urllib.parse import unquote
+
+
+def _to_int(value):
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(value)
+    return int(value)
+
+
+def _to_str(value):
+    return value
+
+
+#: Parameter converters, in the order they are tried at one segment.
+CONVERTERS = {
+    "int": _to_int,
+    "float": float,
+    "str": _to_str,
+}
+
+#: Keyword arguments handlers already receive; not usable as parameter names.
+RESERVED_NAMES = ("headers", "body", "query", "params")
+
+
+def parse_segment(segment):
+    """
+    Return ``(converter, name)`` for a ``<...>`` segment, or ``None`` for a
+    static one.
+
+    :raise ValueError: for an unknown converter or a reserved name.
+    """
+    if not (segment.startswith("<") and segment.endswith(">")):
+        return None
+    conv, _, name = segment[1:-1].rpartition(":")
+    conv = conv or "str"
+    if conv not in CONVERTERS and conv != "path":
+        raise ValueError("unknown path converter {!r}".format(conv))
+    if not name.isidentifier() or name in RESERVED_NAMES:
+        raise ValueError("bad path parameter name {!r}".format(name))
+    return conv, name
+
+
+class _Node:
+    __slots__ = ("static", "params", "wildcard", "handlers")
+
+    def __init__(self):
+        self.static = {}       # segment -> _Node
+        self.params = []       # (converter, name, _Node), in CONVERTERS order
+        self.wildcard = None   # (name, _Node)
+        self.handlers = {}     # method -> handler
+
+
+class Router(dict):
+    """Route table keyed by ``(METHOD, path)``, with path parameters.
+
+    Routes are inserted in the tree as they are added; it is rebuilt on the
+    first lookup after one was removed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._root = _Node()
+        self._stale = False
+        self.update(*args, **kwargs)
+
+    # mutation keeps the tree in step
+
+    def __setitem__(self, key, handler):
+        method, path = key
+        self._insert(method, path, handler)    # validates the pattern
+        super().__setitem__(key, handler)
+
+    def update(self, *args, **kwargs):
+        for key, handler in dict(*args, **kwargs).items():
+            self[key] = handler
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._stale = True
+
+    def pop(self, key, *default):
+        self._stale = True
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self._stale = True
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._root = _Node()
+        self._stale = False
+
+    def _insert(self, method, path, handler):
+        node = self._root
+        segments = path.split("/")[1:]
+        for i, segment in enumerate(segments):
+            spec = parse_segment(segment)
+            if spec is None:
+                node = node.static.setdefault(segment, _Node())
+                continue
+            conv, name = spec
+            if conv == "path":
+                if i != len(segments) - 1:
+                    raise ValueError("<path:{}> must end the route {!r}".format(name, path))
+                if node.wildcard is None or node.wildcard[0] != name:
+                    node.wildcard = (name, _Node())
+                node = node.wildcard[1]
+                break
+            for c, n, child in node.params:
+                if (c, n) == (CONVERTERS[conv], name):
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((CONVERTERS[conv], name, child))
+                order = list(CONVERTERS.values())
+                node.params.sort(key=lambda p: order.index(p[0]))
+                node = child
+        node.handlers[method] = handler
+
+    def _rebuild(self):
+        self._root = _Node()
+        self._stale = False
+        for (method, path), handler in self.items():
+            self._insert(method, path, handler)
+
+    # lookup
+
+    def _walk(self, node, segments, i, method, params):
+        if i == len(segments):
+            if node.handlers and (method is None or method in node.handlers):
+                return node
+            return None
+        segment = segments[i]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._walk(child, segments, i + 1, method, params)
+            if found is not None:
+                return found
+        if segment:
+            for conv, name, child in node.params:
+                try:
+                    params[name] = conv(unquote(segment))
+                except ValueError:
+                    continue
+                found = self._walk(child, segments, i + 1, method, params)
+                if found is not None:
+                    return found
+                del params[name]
+        if node.wildcard is not None:
+            name, child = node.wildcard
+            if child.handlers and (method is None or method in child.handlers):
+                params[name] = unquote("/".join(segments[i:]))
+                return child
+        return None
+
+    def match(self, method, path):
+        """
+        Find the handler of ``method`` on ``path``.
+
+        :rtype: tuple - ``(handler, params, allowed)``: ``params`` maps the
+            path parameters to their converted values. If the path only
+            matches under other methods, ``handler`` is ``None`` and
+            ``allowed`` lists them; it is ``None`` when nothing matches.
+        """
+        handler = dict.get(self, (method, path))
+        if handler is not None and "<" not in path:
+            return handler, {}, None
+        if self._stale:
+            self._rebuild()
+        segments = path.split("/")[1:]
+        params = {}
+        node = self._walk(self._root, segments, 0, method, params)
+        if node is not None:
+            return node.handlers[method], params, None
+        node = self._walk(self._root, segments, 0, None, {})
+        if node is None:
+            return None, {}, None
+        return None, {}, sorted(node.handlers)
+
+
+def find_route(routes, method, path):
+    """
+    Look ``method`` and ``path`` up in ``routes``, a :class:`Router` or a
+    plain dict (exact paths only). Returns the same triple as
+    :meth:`Router.match`.
+    """
+    if isinstance(routes, Router):
+        return routes.match(method, path)
+    return routes.get((method, path)), {}, None
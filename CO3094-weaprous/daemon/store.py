@@ -0,0 +1,603 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.store
+~~~~~~~~~~~~~~~~~
+
+This module provides the storage engines behind the tracker endpoints of
+:mod:`daemon.backend` (peer registry and channel history).
+
+- :class:`JsonStore`: the original whole-file ``peers.json`` /
+  ``channels.json`` store. Every call loads and rewrites the file.
+- :class:`LogStore`: one append-only log per channel (a JSON object per
+  line) plus an in-memory index of record offsets, so posting is a single
+  append and reading a page is one seek and one read.
+- :class:`SqliteStore`: a single SQLite database in WAL mode with indexed
+  tables, for transactional writes under concurrency.
+
+All stores expose the same methods; :func:`open_store` builds one by name.
+Channel messages carry an ``id``: their sequence number in the channel,
+starting at 0 and never reused, which :meth:`read_channel` pages by.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+DB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "db")
+PEERS_FILE = os.path.join(DB_DIR, "peers.json")
+CHANNEL_FILE = os.path.join(DB_DIR, "channels.json")
+LOG_DIR = os.path.join(DB_DIR, "log")
+SQLITE_FILE = os.path.join(DB_DIR, "tracker.sqlite3")
+
+#: fsync policies of :class:`LogStore`.
+FSYNC_ALWAYS = "always"        # fsync after every append
+FSYNC_INTERVAL = "interval"    # fsync dirty logs every ``fsync_interval``
+FSYNC_NEVER = "never"          # leave it to the OS
+
+#: Seconds between background fsyncs with ``FSYNC_INTERVAL``.
+FSYNC_INTERVAL_SECONDS = 1.0
+
+#: Seconds between compaction passes.
+COMPACT_INTERVAL = 300
+
+#: Connections a :class:`SqliteStore` keeps open; more concurrent callers wait.
+SQLITE_POOL_SIZE = 8
+
+
+def load_json(path, default):
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            json.dump(default, f)
+        return default
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except:
+        return default
+
+
+def save_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+class JsonStore:
+    """The original whole-file JSON store, kept for compatibility."""
+
+    def register_peer(self, ip, port):
+        data = load_json(PEERS_FILE, [])
+        for p in data:
+            if p["ip"] == ip and p["port"] == port:
+                return
+        data.append({"ip": ip, "port": port})
+        save_json(PEERS_FILE, data)
+
+    def list_peers(self):
+        return load_json(PEERS_FILE, [])
+
+    def remove_peers(self, peers):
+        gone = set((p["ip"], p["port"]) for p in peers)
+        if not gone:
+            return
+        data = load_json(PEERS_FILE, [])
+        save_json(PEERS_FILE, [p for p in data if (p["ip"], p["port"]) not in gone])
+
+    def create_channel(self, name):
+        data = load_json(CHANNEL_FILE, {})
+        if name not in data:
+            data[name] = []
+            save_json(CHANNEL_FILE, data)
+
+    def list_channels(self):
+        return load_json(CHANNEL_FILE, {})
+
+    def post_channel(self, name, sender, msg):
+        data = load_json(CHANNEL_FILE, {})
+        if name not in data:
+            data[name] = []
+        data[name].append({"sender": sender, "msg": msg})
+        save_json(CHANNEL_FILE, data)
+        return len(data[name]) - 1
+
+    def read_channel(self, name, start=0, limit=None):
+        history = load_json(CHANNEL_FILE, {}).get(name, [])
+        start = max(0, start)
+        end = None if limit is None else start + limit
+        return [dict(m, id=start + i) for i, m in enumerate(history[start:end])]
+
+    def channel_length(self, name):
+        return len(load_json(CHANNEL_FILE, {}).get(name, []))
+
+    def compact(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Log:
+    """One append-only JSON-lines file and the offsets of its records.
+
+    Records are numbered from ``base``, the id of the first record still in
+    the file, so ids stay stable when a compaction drops the oldest ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = []         # byte offset of each record
+        self.base = 0             # id of the first record
+        self.dirty = False
+        self.garbage = 0          # records/bytes a compaction would drop
+        self.file = open(path, "a+b")
+        self._scan()
+
+    def _scan(self):
+        f = self.file
+        f.seek(0)
+        pos = 0
+        valid_end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break             # torn write from a crash: drop it
+            self.offsets.append(pos)
+            pos += len(line)
+            valid_end = pos
+        if f.tell() != valid_end:
+            f.truncate(valid_end)
+        f.seek(0, os.SEEK_END)
+        self.end = valid_end
+        if self.offsets:
+            f.seek(0)
+            try:
+                self.base = json.loads(f.readline()).get("id", 0)
+            except ValueError:
+                pass
+            f.seek(0, os.SEEK_END)
+
+    @property
+    def next_id(self):
+        return self.base + len(self.offsets)
+
+    def append(self, record, fsync=False, stamp=False):
+        """
+        Append ``record`` and return its id. With ``stamp`` the id is also
+        stored in the record, so it survives compaction.
+        """
+        with self.lock:
+            if stamp:
+                record = dict(record, id=self.next_id)
+            data = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+            self.file.write(data)
+            self.file.flush()
+            if fsync:
+                os.fsync(self.file.fileno())
+            else:
+                self.dirty = True
+            self.offsets.append(self.end)
+            self.end += len(data)
+            return self.next_id - 1
+
+    def read(self, start=0, limit=None):
+        """Read up to ``limit`` records from id ``start``, each with its ``id``."""
+        with self.lock:
+            return self._read(start, limit)
+
+    def _read(self, start, limit):
+        count = len(self.offsets)
+        start = max(0, start - self.base)
+        first = self.base + start
+        stop = count if limit is None else min(count, start + limit)
+        if start >= stop:
+            return []
+        begin = self.offsets[start]
+        end = self.offsets[stop] if stop < count else self.end
+        self.file.seek(begin)
+        data = self.file.read(end - begin)
+        out = []
+        for i, line in enumerate(data.splitlines()):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            record.setdefault("id", first + i)
+            out.append(record)
+        return out
+
+    def sync(self):
+        with self.lock:
+            if self.dirty:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def rewrite(self, records):
+        """Atomically replace the log content with ``records``."""
+        with self.lock:
+            self._rewrite(records)
+
+    def trim(self, keep):
+        """
+        Drop the oldest records so at most ``keep`` remain. The records are
+        read and written back under one lock, so concurrent appends are
+        never lost.
+        """
+        with self.lock:
+            extra = len(self.offsets) - keep
+            if extra > 0:
+                self._rewrite(self._read(self.base + extra, None))
+
+    def _rewrite(self, records):
+        tmp = self.path + ".compact"
+        with open(tmp, "wb") as f:
+            offsets = []
+            pos = 0
+            for record in records:
+                data = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+                offsets.append(pos)
+                f.write(data)
+                pos += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a+b")
+        self.offsets = offsets
+        self.base = records[0].get("id", 0) if records else 0
+        self.end = pos
+        self.garbage = 0
+        self.dirty = False
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class LogStore:
+    """Append-only tracker store.
+
+    Each channel lives in ``<root>/channels/<quoted name>.log`` and peers in
+    ``<root>/peers.log`` as ``add``/``del`` records. Offsets of every record
+    are indexed in memory at startup, so :meth:`post_channel` is one append
+    (O(1)) and :meth:`read_channel` reads one page (O(page)).
+
+    A background thread fsyncs dirty logs (``fsync="interval"``) and
+    periodically compacts the peer log and channels over ``max_history``.
+    Existing ``channels.json`` / ``peers.json`` are imported on first use.
+
+    :param fsync (str): ``"always"``, ``"interval"`` or ``"never"``.
+    :param max_history (int): Messages kept per channel on compaction
+        (``None`` keeps everything).
+    """
+
+    def __init__(self, root=LOG_DIR, fsync=FSYNC_INTERVAL,
+                 fsync_interval=FSYNC_INTERVAL_SECONDS,
+                 compact_interval=COMPACT_INTERVAL, max_history=None):
+        self.root = root
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_interval = compact_interval
+        self.max_history = max_history
+        self.channels = {}
+        self._lock = threading.Lock()
+
+        channel_dir = os.path.join(root, "channels")
+        fresh = not os.path.exists(root)
+        os.makedirs(channel_dir, exist_ok=True)
+
+        for fname in sorted(os.listdir(channel_dir)):
+            if fname.endswith(".log"):
+                name = unquote(fname[:-len(".log")])
+                self.channels[name] = _Log(os.path.join(channel_dir, fname))
+
+        self.peers_log = _Log(os.path.join(root, "peers.log"))
+        self.peers = {}
+        for rec in self.peers_log.read():
+            key = (rec.get("ip"), rec.get("port"))
+            if rec.get("op") == "del":
+                self.peers.pop(key, None)
+            else:
+                self.peers[key] = {"ip": key[0], "port": key[1]}
+        self.peers_log.garbage = len(self.peers_log.offsets) - len(self.peers)
+
+        if fresh:
+            self._import_json()
+
+        if fsync == FSYNC_INTERVAL or compact_interval:
+            threading.Thread(target=self._background, daemon=True).start()
+
+    def _import_json(self):
+        if os.path.exists(CHANNEL_FILE):
+            for name, history in load_json(CHANNEL_FILE, {}).items():
+                self.create_channel(name)
+                for m in history:
+                    self._log(name).append(m, stamp=True)
+        if os.path.exists(PEERS_FILE):
+            for p in load_json(PEERS_FILE, []):
+                self.register_peer(p["ip"], p["port"])
+
+    def _log(self, name, create=True):
+        with self._lock:
+            log = self.channels.get(name)
+            if log is None and create:
+                path = os.path.join(self.root, "channels", quote(name, safe="") + ".log")
+                log = _Log(path)
+                self.channels[name] = log
+            return log
+
+    # peers
+
+    def register_peer(self, ip, port):
+        with self._lock:
+            if (ip, port) in self.peers:
+                return
+            self.peers[(ip, port)] = {"ip": ip, "port": port}
+            self.peers_log.append({"op": "add", "ip": ip, "port": port},
+                                  self.fsync == FSYNC_ALWAYS)
+
+    def list_peers(self):
+        with self._lock:
+            return list(self.peers.values())
+
+    def remove_peers(self, peers):
+        for p in peers:
+            with self._lock:
+                if self.peers.pop((p["ip"], p["port"]), None) is None:
+                    continue
+                self.peers_log.append({"op": "del", "ip": p["ip"], "port": p["port"]},
+                                      self.fsync == FSYNC_ALWAYS)
+                self.peers_log.garbage += 2
+
+    # channels
+
+    def create_channel(self, name):
+        self._log(name)
+
+    def list_channels(self):
+        with self._lock:
+            names = list(self.channels)
+        return {name: self.read_channel(name) for name in names}
+
+    def post_channel(self, name, sender, msg):
+        return self._log(name).append({"sender": sender, "msg": msg},
+                                      self.fsync == FSYNC_ALWAYS, stamp=True)
+
+    def read_channel(self, name, start=0, limit=None):
+        log = self._log(name, create=False)
+        return log.read(start, limit) if log else []
+
+    def channel_length(self, name):
+        log = self._log(name, create=False)
+        return log.next_id if log else 0
+
+    # maintenance
+
+    def sync(self):
+        with self._lock:
+            logs = list(self.channels.values())
+        for log in logs + [self.peers_log]:
+            log.sync()
+
+    def compact(self):
+        """
+        Rewrite the peer log with only live peers, and trim channels longer
+        than ``max_history``. Logs without garbage are left untouched.
+
+        Peer records are appended under ``self._lock``, which is held here
+        from the snapshot to the rewrite, so no ``add``/``del`` slips in
+        between.
+        """
+        with self._lock:
+            if self.peers_log.garbage:
+                live = [{"op": "add", "ip": p["ip"], "port": p["port"]}
+                        for p in self.peers.values()]
+                self.peers_log.rewrite(live)
+
+        if self.max_history:
+            with self._lock:
+                logs = list(self.channels.values())
+            for log in logs:
+                log.trim(self.max_history)
+
+    def _background(self):
+        last_compact = time.monotonic()
+        while True:
+            time.sleep(self.fsync_interval)
+            if self.fsync == FSYNC_INTERVAL:
+                self.sync()
+            if self.compact_interval and time.monotonic() - last_compact >= self.compact_interval:
+                last_compact = time.monotonic()
+                try:
+                    self.compact()
+                except OSError as e:
+                    print("[Store] Compaction failed:", e)
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            logs = list(self.channels.values())
+        for log in logs + [self.peers_log]:
+            log.close()
+
+
+class SqliteStore:
+    """SQLite tracker store.
+
+    One WAL-mode database shared by all threads through a bounded pool of
+    ``pool_size`` connections (readers never block the writer). A call checks
+    a connection out for its statements and hands it back, so the number of
+    open connections does not follow the number of request threads.
+    Statements are fixed strings so sqlite3's statement cache reuses their
+    prepared form. Messages are keyed by ``(channel, id)``, where ``id`` is
+    the position in the channel, and peers are unique on ``(ip, port)``.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS peers ("
+        " ip TEXT NOT NULL, port INTEGER NOT NULL)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS peers_addr ON peers (ip, port)",
+        "CREATE TABLE IF NOT EXISTS channels (name TEXT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS messages ("
+        " channel TEXT NOT NULL, id INTEGER NOT NULL,"
+        " sender TEXT, msg TEXT,"
+        " PRIMARY KEY (channel, id)) WITHOUT ROWID",
+    )
+
+    def __init__(self, path=SQLITE_FILE, busy_timeout=5.0, pool_size=SQLITE_POOL_SIZE):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = []           # connections checked in, most recent last
+        self._lock = threading.Lock()
+
+        fresh = not os.path.exists(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db, db:
+            for stmt in self.SCHEMA:
+                db.execute(stmt)
+        if fresh:
+            self._import_json()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                             isolation_level=None, cached_statements=64,
+                             check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def _db(self):
+        """Check a connection out of the pool for the duration of a call."""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                db = self._idle.pop() if self._idle else None
+            if db is None:
+                db = self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            with self._lock:
+                self._idle.append(db)
+            self._slots.release()
+
+    def _import_json(self):
+        if os.path.exists(CHANNEL_FILE):
+            for name, history in load_json(CHANNEL_FILE, {}).items():
+                self.create_channel(name)
+                for m in history:
+                    self.post_channel(name, m.get("sender"), m.get("msg"))
+        if os.path.exists(PEERS_FILE):
+            for p in load_json(PEERS_FILE, []):
+                self.register_peer(p["ip"], p["port"])
+
+    # peers
+
+    def register_peer(self, ip, port):
+        with self._db() as db:
+            db.execute("INSERT OR IGNORE INTO peers (ip, port) VALUES (?, ?)", (ip, port))
+
+    def list_peers(self):
+        with self._db() as db:
+            rows = db.execute("SELECT ip, port FROM peers ORDER BY rowid")
+            return [{"ip": ip, "port": port} for ip, port in rows]
+
+    def remove_peers(self, peers):
+        if not peers:
+            return
+        with self._db() as db, db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("DELETE FROM peers WHERE ip = ? AND port = ?",
+                           [(p["ip"], p["port"]) for p in peers])
+
+    # channels
+
+    def create_channel(self, name):
+        with self._db() as db:
+            db.execute("INSERT OR IGNORE INTO channels (name) VALUES (?)", (name,))
+
+    def list_channels(self):
+        with self._db() as db:
+            out = {name: [] for (name,) in db.execute("SELECT name FROM channels ORDER BY rowid")}
+            rows = db.execute("SELECT channel, id, sender, msg FROM messages ORDER BY channel, id")
+            for channel, i, sender, msg in rows:
+                out.setdefault(channel, []).append({"id": i, "sender": sender, "msg": msg})
+        return out
+
+    def post_channel(self, name, sender, msg):
+        with self._db() as db, db:
+            # IMMEDIATE takes the write lock up front so concurrent posts
+            # cannot pick the same id
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR IGNORE INTO channels (name) VALUES (?)", (name,))
+            (next_id,) = db.execute(
+                "SELECT COALESCE(MAX(id) + 1, 0) FROM messages WHERE channel = ?",
+                (name,)).fetchone()
+            db.execute(
+                "INSERT INTO messages (channel, id, sender, msg) VALUES (?, ?, ?, ?)",
+                (name, next_id, sender, msg))
+        return next_id
+
+    def read_channel(self, name, start=0, limit=None):
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT id, sender, msg FROM messages WHERE channel = ? AND id >= ?"
+                " ORDER BY id LIMIT ?",
+                (name, max(0, start), -1 if limit is None else limit))
+            return [{"id": i, "sender": sender, "msg": msg} for i, sender, msg in rows]
+
+    def channel_length(self, name):
+        with self._db() as db:
+            (count,) = db.execute(
+                "SELECT COALESCE(MAX(id) + 1, 0) FROM messages WHERE channel = ?",
+                (name,)).fetchone()
+        return count
+
+    def compact(self):
+        with self._db() as db:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """Close the idle connections; ones checked out are closed at exit."""
+        with self._lock:
+            conns, self._idle = self._idle, []
+        for db in conns:
+            db.close()
+
+
+STORES = {
+    "json": JsonStore,
+    "log": LogStore,
+    "sqlite": SqliteStore,
+}
+
+
+def open_store(kind="log", **options):
+    """Build the tracker store named ``kind`` (see :data:`STORES`)."""
+    try:
+        factory = STORES[kind]
+    except KeyError:
+        raise ValueError("Unknown store {!r}, expected one of {}".format(kind, ", ".join(STORES)))
+    return factory(**options)
@@ -18,6 +18,7 @@ This module provides a WeApRous object to deploy RESTful url web app with routin
 """
 
 from .backend import create_backend
+from .router import Router
 
 class WeApRous:
     """The fully mutable :class:`WeApRous <WeApRous>` object, which is a lightweight,
@@ -40,6 +41,15 @@ class WeApRous:
       >>> def hello(headers, body):
       >>>     return {'message': 'Hello, world!'}
 
+      >>> @app.route('/users/<int:uid>/posts/<slug>', methods=['GET'])
+      >>> def post(headers, body, uid, slug):
+      >>>     return {'user': uid, 'post': slug}
+
+      >>> @app.websocket('/echo')
+      >>> def echo(ws, headers):
+      >>>     for msg in iter(ws.receive, None):
+      >>>         ws.send(msg)
+
       >>> app.run()
     """
 
@@ -49,7 +59,7 @@ class WeApRous:
 
         Sets up an empty route registry and prepares placeholders for IP and port.
         """
-        self.routes = {}
+        self.routes = Router()
         self.ip = None
         self.port = None
         return
@@ -68,6 +78,11 @@ class WeApRous:
         """
         Decorator to register a route handler for a specific path and HTTP methods.
 
+        The path may hold parameters (``<name>``, ``<int:name>``,
+        ``<float:name>``, ``<path:name>``, see :mod:`daemon.router`); the
+        handler receives each one as a keyword argument of the same name
+        if it declares it, and all of them as ``params`` if it declares that.
+
         :param path (str): The URL path to route.
         :param methods (list): A list of HTTP methods (e.g., ['GET', 'POST']) to bind.
 
@@ -84,18 +99,40 @@ class WeApRous:
             return func
         return decorator
 
-    def run(self):
+    def websocket(self, path):
+        """
+        Decorator to register a WebSocket handler for ``path``.
+
+        The handler is called as ``handler(ws, headers)`` with a
+        :class:`WebSocket <daemon.websocket.WebSocket>` once the upgrade
+        handshake is done, and the connection is closed when it returns.
+
+        :param path (str): The URL path clients upgrade on.
+
+        :rtype: function - A decorator that registers the handler function.
+        """
+        def decorator(func):
+            self.routes[("WEBSOCKET", path)] = func
+            func._route_path = path
+            func._route_methods = ["WEBSOCKET"]
+            return func
+        return decorator
+
+    def run(self, event_loop=False):
         """
         Start the backend server and begin handling requests.
 
         This method launches the TCP server using the configured IP and port,
         and dispatches incoming requests to the registered route handlers.
 
+        :param event_loop (bool): Serve from the shared selectors loop instead
+            of one thread per connection.
+
         :raise: Error if IP or port has not been configured.
         """
         if not self.ip or not self.port:
             print("Rous app need to preapre address"
                   "by calling app.prepare_address(ip,port)")
 
-        create_backend(self.ip, self.port, self.routes)
+        create_backend(self.ip, self.port, self.routes, event_loop)
         
@@ -0,0 +1,359 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.websocket
+~~~~~~~~~~~~~~~~~
+
+This module implements the server side of the WebSocket protocol (RFC 6455)
+for routes registered with :meth:`WeApRous.websocket
+<daemon.weaprous.WeApRous.websocket>`. The upgrade handshake itself is
+answered by :class:`HttpAdapter <daemon.httpadapter.HttpAdapter>`.
+
+A :class:`WebSocket` has its own reader thread, which reassembles fragmented
+messages into a bounded inbox for :meth:`WebSocket.receive` and answers
+pings and pongs whether or not the route handler is reading, and its own
+writer thread, which drains a bounded send queue, fragments large messages,
+and pings idle peers. :meth:`WebSocket.send` blocks while the queue is full,
+so a slow client pushes back on the producer instead of growing memory.
+"""
+
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+#: Close status codes used by the server.
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_BIG = 1009
+
+#: Largest message accepted from a client, after reassembly.
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+#: Messages sent in frames of at most this many bytes.
+FRAGMENT_SIZE = 64 * 1024
+
+#: Messages queued for the writer before :meth:`WebSocket.send` blocks.
+SEND_QUEUE_SIZE = 64
+
+#: Received messages held for :meth:`WebSocket.receive`; past this the
+#: reader stops reading until the handler catches up.
+RECEIVE_QUEUE_SIZE = 64
+
+#: Seconds :meth:`WebSocket.send` waits for queue space by default.
+SEND_TIMEOUT = 10
+
+#: Seconds of silence before the server pings; the connection is dropped
+#: after two intervals without any frame from the client.
+PING_INTERVAL = 20
+
+RECV_SIZE = 64 * 1024
+
+
+def accept_key(key):
+    """Return the ``Sec-WebSocket-Accept`` value for a client key."""
+    digest = hashlib.sha1((key.strip() + GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def encode_frame(opcode, payload=b"", fin=True):
+    """Encode one unmasked (server to client) frame."""
+    head = bytearray([(0x80 if fin else 0) | opcode])
+    n = len(payload)
+    if n < 126:
+        head.append(n)
+    elif n < 0x10000:
+        head.append(126)
+        head += struct.pack("!H", n)
+    else:
+        head.append(127)
+        head += struct.pack("!Q", n)
+    return bytes(head) + payload
+
+
+def unmask(payload, mask):
+    n = len(payload)
+    if not n:
+        return payload
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], "big")
+    return (int.from_bytes(payload, "big") ^ key).to_bytes(n, "big")
+
+
+class WebSocketError(Exception):
+    """Protocol violation by the client; closes with ``code``."""
+
+    def __init__(self, code, reason=""):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class WebSocket:
+    """One accepted WebSocket connection.
+
+    Usage::
+      >>> @app.websocket("/echo")
+      >>> def echo(ws, headers):
+      >>>     while True:
+      >>>         msg = ws.receive()
+      >>>         if msg is None:
+      >>>             break
+      >>>         ws.send(msg)
+
+    :param conn (socket.socket): The upgraded connection.
+    :param prefix (bytes): Bytes read past the handshake request.
+    """
+
+    def __init__(self, conn, prefix=b"", max_message=MAX_MESSAGE_SIZE,
+                 queue_size=SEND_QUEUE_SIZE, ping_interval=PING_INTERVAL,
+                 receive_size=RECEIVE_QUEUE_SIZE):
+        self.conn = conn
+        self.max_message = max_message
+        self.queue_size = queue_size
+        self.receive_size = receive_size
+        self.ping_interval = ping_interval
+        self.closed = False
+        self.close_code = None
+        self._buf = bytearray(prefix)
+        self._control = deque()       # pongs, sent before queued data
+        self._data = deque()          # lists of frames, one list per message
+        self._inbox = deque()         # received messages, oldest first
+        self._eof = False             # reader done, nothing more will arrive
+        self._closing = False         # close frame queued, accept no more data
+        self._cond = threading.Condition()
+        self._last_seen = time.monotonic()
+
+        conn.settimeout(None)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    # reading
+
+    def _recv_exact(self, n):
+        buf = self._buf
+        while len(buf) < n:
+            chunk = self.conn.recv(max(RECV_SIZE, n - len(buf)))
+            if not chunk:
+                raise WebSocketError(CLOSE_GOING_AWAY, "connection closed")
+            buf += chunk
+        data = bytes(buf[:n])
+        del buf[:n]
+        return data
+
+    def _read_frame(self):
+        b1, b2 = self._recv_exact(2)
+        fin = bool(b1 & 0x80)
+        opcode = b1 & 0x0F
+        length = b2 & 0x7F
+        if b1 & 0x70:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, "reserved bits set")
+        if not b2 & 0x80:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, "client frames must be masked")
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(8))[0]
+        if opcode >= OP_CLOSE and (not fin or length > 125):
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, "bad control frame")
+        if length > self.max_message:
+            raise WebSocketError(CLOSE_TOO_BIG, "message too big")
+        mask = self._recv_exact(4)
+        payload = unmask(self._recv_exact(length), mask)
+        self._last_seen = time.monotonic()
+        return fin, opcode, payload
+
+    def receive(self):
+        """
+        Return the next message: ``str`` for text, ``bytes`` for binary, or
+        ``None`` once the connection is closed.
+
+        A handler that only sends does not have to call it: pings and pongs
+        are handled by the reader thread. Up to ``receive_size`` messages
+        are kept for it; past that the reader waits, so a handler that
+        ignores a chatty client should still drain them.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._inbox or self._eof)
+            if self._inbox:
+                message = self._inbox.popleft()
+                self._cond.notify_all()       # wake a reader waiting for room
+                return message
+        self.join(1)
+        return None
+
+    def _deliver(self, message):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._inbox) < self.receive_size or self.closed)
+            if self.closed:
+                return
+            self._inbox.append(message)
+            self._cond.notify_all()
+
+    def _read_loop(self):
+        message = None
+        kind = None
+        try:
+            while not self.closed:
+                fin, opcode, payload = self._read_frame()
+                if opcode == OP_PING:
+                    with self._cond:
+                        self._control.append(encode_frame(OP_PONG, payload))
+                        self._cond.notify_all()
+                    continue
+                if opcode == OP_PONG:
+                    continue
+                if opcode == OP_CLOSE:
+                    code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                    self.close_code = code
+                    self.close(code)
+                    break
+                if opcode == OP_CONTINUATION:
+                    if message is None:
+                        raise WebSocketError(CLOSE_PROTOCOL_ERROR, "unexpected continuation")
+                    message += payload
+                elif opcode in (OP_TEXT, OP_BINARY):
+                    if message is not None:
+                        raise WebSocketError(CLOSE_PROTOCOL_ERROR, "expected continuation")
+                    message = bytearray(payload)
+                    kind = opcode
+                else:
+                    raise WebSocketError(CLOSE_PROTOCOL_ERROR, "unknown opcode")
+                if len(message) > self.max_message:
+                    raise WebSocketError(CLOSE_TOO_BIG, "message too big")
+                if not fin:
+                    continue
+                if kind == OP_BINARY:
+                    self._deliver(bytes(message))
+                else:
+                    try:
+                        self._deliver(message.decode("utf-8"))
+                    except UnicodeDecodeError:
+                        raise WebSocketError(CLOSE_INVALID_DATA, "invalid utf-8")
+                message = None
+        except WebSocketError as e:
+            self.close(e.code, e.reason)
+        except OSError:
+            self._shutdown()
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    # writing
+
+    def _frames(self, message):
+        if isinstance(message, (dict, list)):
+            message = json.dumps(message)
+        if isinstance(message, str):
+            opcode, payload = OP_TEXT, message.encode("utf-8")
+        else:
+            opcode, payload = OP_BINARY, bytes(message)
+        if len(payload) <= FRAGMENT_SIZE:
+            return [encode_frame(opcode, payload)]
+        frames = []
+        for start in range(0, len(payload), FRAGMENT_SIZE):
+            chunk = payload[start:start + FRAGMENT_SIZE]
+            last = start + FRAGMENT_SIZE >= len(payload)
+            frames.append(encode_frame(opcode if start == 0 else OP_CONTINUATION, chunk, last))
+        return frames
+
+    def send(self, message, timeout=SEND_TIMEOUT):
+        """
+        Queue ``message`` (``str``, ``bytes``, or a ``dict``/``list`` sent as
+        JSON text). Blocks while ``queue_size`` messages are waiting.
+
+        :rtype: bool - ``False`` if the connection is closed or the queue
+            stayed full for ``timeout`` seconds.
+        """
+        frames = self._frames(message)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while len(self._data) >= self.queue_size and not self._closing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            if self._closing:
+                return False
+            self._data.append(frames)
+            self._cond.notify_all()
+        return True
+
+    def close(self, code=CLOSE_NORMAL, reason=""):
+        """Send a close frame after the queued messages and stop sending."""
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._data.append([encode_frame(OP_CLOSE, struct.pack("!H", code) + reason.encode()[:120])])
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait for the writer to flush the queue and the close frame."""
+        self._writer.join(timeout)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._control and not self._data and not self.closed:
+                    if not self._cond.wait(self.ping_interval):
+                        break
+                if self.closed:
+                    return
+                if self._control:
+                    frames = [self._control.popleft()]
+                elif self._data:
+                    frames = self._data.popleft()
+                    self._cond.notify_all()       # wake blocked senders
+                else:
+                    frames = None
+            if frames is None:
+                if time.monotonic() - self._last_seen > 2 * self.ping_interval:
+                    self._shutdown()
+                    return
+                frames = [encode_frame(OP_PING)]
+            try:
+                for frame in frames:
+                    self.conn.sendall(frame)
+            except OSError:
+                self._shutdown()
+                return
+            if (frames[-1][0] & 0x0F) == OP_CLOSE:
+                self._shutdown()
+                return
+
+    def _shutdown(self):
+        with self._cond:
+            self.closed = True
+            self._closing = True
+            self._cond.notify_all()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
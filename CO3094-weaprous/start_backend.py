@@ -40,6 +40,10 @@ if __name__ == "__main__":
 
     :arg --server-ip (str): IP address to bind the server (default: 127.0.0.1).
     :arg --server-port (int): Port number to bind the server (default: 9000).
+    :arg --store (str): Tracker storage engine, log, sqlite or json (default: log).
+    :arg --fsync (str): fsync policy of the log store (default: interval).
+    :arg --liveness (str): Peer liveness, lease (heartbeats) or probe (default: lease).
+    :arg --event-loop (flag): Use the non-blocking event-loop serving core.
     """
 
     parser = argparse.ArgumentParser(
@@ -58,9 +62,35 @@ if __name__ == "__main__":
         default=PORT,
         help='Port number to bind the server. Default is {}.'.format(PORT)
     )
+    parser.add_argument(
+        '--store',
+        choices=['log', 'sqlite', 'json'],
+        default='log',
+        help='Tracker storage engine. Default is log (append-only logs).'
+    )
+    parser.add_argument(
+        '--fsync',
+        choices=['always', 'interval', 'never'],
+        default='interval',
+        help='fsync policy of the log store. Default is interval.'
+    )
+    parser.add_argument(
+        '--liveness',
+        choices=['lease', 'probe'],
+        default='lease',
+        help='How online peers are tracked: lease (client heartbeats) or probe '
+             '(background TCP probes). Default is lease.'
+    )
+    parser.add_argument(
+        '--event-loop',
+        action='store_true',
+        help='Serve connections from a selectors/epoll loop instead of one thread each.'
+    )
  
     args = parser.parse_args()
     ip = args.server_ip
     port = args.server_port
 
-    create_backend(ip, port)
+    store_options = {'fsync': args.fsync} if args.store == 'log' else {}
+    create_backend(ip, port, event_loop=args.event_loop, store=args.store,
+                   liveness=args.liveness, **store_options)
@@ -5,71 +5,118 @@ import socket
 import time
 
 from daemon.weaprous import WeApRous
-from apps.peer import PeerNode
+from apps.peer import GOSSIP_FANOUT, PeerNode
 from apps.routes import ChatRoutes
 from daemon.backend import run_backend
 from apps.chat_backend import run_chat_backend
 
 TRACKER_IP = "127.0.0.1"
 TRACKER_PORT = 9000       # backend server
+HEARTBEAT_INTERVAL = 5    # seconds, until the tracker reports its lease ttl
 
 
-def start_peer_node(peer):
-    peer.run()
+def start_peer_node(peer, event_loop=False):
+    peer.run(event_loop)
 
 
 def start_webapp(app):
     run_backend(my_ip, ui_port, app.routes)
 
 
-def register_to_tracker(my_ip, my_port):
+def tracker_post(path, payload, timeout=3):
     """
-    Register this client to the central backend server.
+    POST ``payload`` as JSON to the tracker and return the decoded JSON reply.
     """
+    body = json.dumps(payload)
+    req = (
+        f"POST {path} HTTP/1.1\r\n"
+        f"Host: {TRACKER_IP}:{TRACKER_PORT}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+        + body
+    )
+    s = socket.create_connection((TRACKER_IP, TRACKER_PORT), timeout=timeout)
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((TRACKER_IP, TRACKER_PORT))
-
-        req = (
-            "POST /submit-info HTTP/1.1\r\n"
-            f"Host: {TRACKER_IP}:{TRACKER_PORT}\r\n"
-            "Content-Type: application/json\r\n"
-            f"Content-Length: {len(json.dumps({'ip': my_ip, 'port': my_port}))}\r\n"
-            "\r\n"
-            + json.dumps({"ip": my_ip, "port": my_port})
-        )
-
         s.sendall(req.encode())
+        data = b""
+        while True:
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    finally:
         s.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1] or b"null")
+
+
+def register_to_tracker(my_ip, my_port):
+    """
+    Register this client to the central backend server.
+    """
+    try:
+        tracker_post("/submit-info", {"ip": my_ip, "port": my_port})
         print("[ChatApp] Registered to tracker")
     except:
         print("[ChatApp] Could NOT register to tracker (server offline)")
 
 
+def heartbeat_to_tracker(my_ip, my_port):
+    """
+    Keep this client's tracker lease alive, renewing it every third of the
+    lease ttl. A tracker restart is picked up on the next heartbeat.
+    """
+    register_to_tracker(my_ip, my_port)
+    interval = HEARTBEAT_INTERVAL
+    while True:
+        time.sleep(interval)
+        try:
+            reply = tracker_post("/heartbeat", {"ip": my_ip, "port": my_port})
+            if isinstance(reply, dict) and reply.get("ttl"):
+                interval = max(1, reply["ttl"] / 3)
+        except (OSError, ValueError, IndexError):
+            print("[ChatApp] Heartbeat failed (tracker offline)")
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--ui-port", type=int, default=8001)
     parser.add_argument("--peer-port", type=int, default=7001)
     parser.add_argument("--my-ip", default="127.0.0.1")
+    parser.add_argument("--event-loop", action="store_true",
+                        help="serve UI and peer sockets from a selectors/epoll loop")
+    parser.add_argument("--wire-format", choices=["json", "msgpack"], default="json",
+                        help="encoding of packets sent to peers (msgpack needs the "
+                             "msgpack package on every peer)")
+    parser.add_argument("--broadcast", choices=["direct", "gossip"], default="direct",
+                        help="send broadcasts to every connected peer, or gossip "
+                             "them through a few random ones")
+    parser.add_argument("--fanout", type=int, default=GOSSIP_FANOUT,
+                        help="peers each node forwards a gossip broadcast to")
+    parser.add_argument("--message-spill", metavar="PATH",
+                        help="append messages evicted from memory to this file "
+                             "so old history stays readable")
     args = parser.parse_args()
 
     my_ip = args.my_ip
     ui_port = args.ui_port
     peer_port = args.peer_port
 
-    peer = PeerNode(my_ip, peer_port)
+    peer = PeerNode(my_ip, peer_port, args.wire_format, args.broadcast, args.fanout,
+                    spill_path=args.message_spill)
 
     app = WeApRous()
     routes = ChatRoutes(app, peer)
 
     app.prepare_address(my_ip, ui_port)
 
-    # Register to backend tracker
-    threading.Thread(target=register_to_tracker, args=(my_ip, peer_port), daemon=True).start()
+    # Register to backend tracker and keep the lease alive
+    threading.Thread(target=heartbeat_to_tracker, args=(my_ip, peer_port), daemon=True).start()
 
     # Start peer node (listening for P2P messages)
-    threading.Thread(target=start_peer_node, args=(peer,), daemon=True).start()
+    threading.Thread(target=start_peer_node, args=(peer, args.event_loop), daemon=True).start()
 
     # Start UI webapp
-    run_chat_backend(my_ip, ui_port, app.routes)
+    run_chat_backend(my_ip, ui_port, app.routes, args.event_loop)
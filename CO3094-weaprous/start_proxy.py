@@ -43,6 +43,8 @@ from urllib.parse import urlparse
 from collections import defaultdict
 
 from daemon import create_proxy
+from daemon.pool import POOL_MAX_SIZE
+from daemon.health import CHECK_INTERVAL, MAX_FAILS
 
 PROXY_PORT = 8080
 
@@ -67,16 +69,17 @@ def parse_virtual_hosts(config_file):
     for host, block in host_blocks:
         proxy_map = {}
 
-        # Find all proxy_pass entries
-        proxy_passes = re.findall(r'proxy_pass\s+http://([^\s;]+);', block)
+        # Find all proxy_pass entries, keeping options such as weight=N
+        proxy_passes = [" ".join(m.split())
+                        for m in re.findall(r'proxy_pass\s+http://([^;]+);', block)]
         map = proxy_map.get(host,[])
         map = map + proxy_passes
         proxy_map[host] = map
 
-        # Find dist_policy if present
-        policy_match = re.search(r'dist_policy\s+(\w+)', block)
+        # Find dist_policy if present (with an optional hash key argument)
+        policy_match = re.search(r'dist_policy\s+([\w-]+)(?:[ \t]+([\w:-]+))?', block)
         if policy_match:
-            dist_policy_map = policy_match.group(1)
+            dist_policy_map = " ".join(g for g in policy_match.groups() if g)
         else: #default policy is round_robin
             dist_policy_map = 'round-robin'
             
@@ -116,6 +119,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='Proxy', description='', epilog='Proxy daemon')
     parser.add_argument('--server-ip', default='0.0.0.0')
     parser.add_argument('--server-port', type=int, default=PROXY_PORT)
+    parser.add_argument('--event-loop', action='store_true',
+                        help='Serve clients from a selectors/epoll loop instead of one thread each.')
+    parser.add_argument('--buffered', action='store_true',
+                        help='Buffer whole requests/responses instead of streaming them.')
+    parser.add_argument('--pool-size', type=int, default=POOL_MAX_SIZE,
+                        help='Idle keep-alive connections kept per upstream (0 disables pooling).')
+    parser.add_argument('--health-check', default='tcp',
+                        help="Active probe: 'tcp', 'http:/path' or 'off'.")
+    parser.add_argument('--health-interval', type=float, default=CHECK_INTERVAL,
+                        help='Seconds between active probes of each upstream.')
+    parser.add_argument('--max-fails', type=int, default=MAX_FAILS,
+                        help='Consecutive failures before an upstream is ejected.')
  
     args = parser.parse_args()
     ip = args.server_ip
@@ -123,4 +138,6 @@ if __name__ == "__main__":
 
     routes = parse_virtual_hosts("config/proxy.conf")
 
-    create_proxy(ip, port, routes)
+    health_check = None if args.health_check == 'off' else args.health_check
+    create_proxy(ip, port, routes, args.event_loop, not args.buffered, args.pool_size,
+                 health_check, args.health_interval, args.max_fails)
@@ -65,6 +65,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='Backend', description='', epilog='Beckend daemon')
     parser.add_argument('--server-ip', default='0.0.0.0')
     parser.add_argument('--server-port', type=int, default=PORT)
+    parser.add_argument('--event-loop', action='store_true')
  
     args = parser.parse_args()
     ip = args.server_ip
@@ -72,4 +73,4 @@ if __name__ == "__main__":
 
     # Prepare and launch the RESTful application
     app.prepare_address(ip, port)
-    app.run()
\ No newline at end of file
+    app.run(event_loop=args.event_loop)
\ No newline at end of file
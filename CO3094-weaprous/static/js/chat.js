@@ -1,7 +1,15 @@
-const REFRESH_INTERVAL = 3000;
+const REFRESH_INTERVAL = 3000;   // polling fallback without EventSource
+const CHANNEL_PAGE = 200;
+const TRACKER_URL = "http://127.0.0.1:9000";
 
 let currentChat = null;
 let myId = null;
+// last channel message id rendered, so refreshes only fetch newer ones
+let channelCursor = { name: null, last: null, loading: false };
+// local P2P message log, kept in sync by "message" events
+let messageLog = [];
+// WebSocket to the chat app while it is open (see connectLocalSocket)
+let localSocket = null;
 const notifiedBroadcasts = new Set();
 
 function q(s){return document.querySelector(s)}
@@ -47,7 +55,10 @@ function escapeHtml(s){
 }
 
 async function refreshOnlinePeers(){
-  let r = await apiGET("/get-list");
+  renderOnlinePeers(await apiGET("/get-list"));
+}
+
+function renderOnlinePeers(r){
   if(typeof r === "string"){
     try { r = JSON.parse(r); } catch(e){ r = []; }
   }
@@ -91,7 +102,7 @@ async function refreshOnlinePeers(){
 }
 
 async function refreshChannels(){
-  let r = await apiGET("http://127.0.0.1:9000/channels");
+  let r = await apiGET(TRACKER_URL + "/channels");
   let list = q("#channelsList");
   if(!list) return;
 
@@ -122,18 +133,21 @@ async function refreshChannels(){
 async function createChannel(){
   let name = q("#createChannelInput").value.trim();
   if(!name) return;
-  await apiPOST("http://127.0.0.1:9000/create-channel", { name });
+  await apiPOST(TRACKER_URL + "/create-channel", { name });
   refreshChannels();
   addNotification("Channel created: " + name);
 }
 
 
 async function refreshPending(){
-  let r = await apiGET("/get-pending");
+  renderPending(await apiGET("/get-pending"));
+}
+
+function renderPending(r){
   let ul = q("#pendingRequests");
   ul.innerHTML = "";
 
-  (r || []).forEach(req => {
+  (Array.isArray(r) ? r : []).forEach(req => {
     let li = document.createElement("li");
     li.className = "list-group-item d-flex justify-content-between align-items-center";
 
@@ -166,7 +180,10 @@ async function refreshPending(){
 }
 
 async function refreshConnected(){
-  let r = await apiGET("/get-connected");
+  renderConnected(await apiGET("/get-connected"));
+}
+
+function renderConnected(r){
 
   if(r && typeof r === "object" && r.status === "ok" && Array.isArray(r.peers)){
     r = r.peers;
@@ -229,8 +246,13 @@ async function refreshConnected(){
 
 async function refreshMessages(){
   let r = await apiGET("/get-messages");
+  if(Array.isArray(r)) messageLog = r;
+  renderMessages();
+}
+
+function renderMessages(){
+  let r = messageLog;
   let win = q("#chatWindow");
-  if(!Array.isArray(r)) r = (r || []);
   win.innerHTML = "";
 
   let showPeer = null;
@@ -406,12 +428,13 @@ function openP2P(s){
 async function broadcastMessage(){
   let msg=prompt("Broadcast message:");
   if(!msg)return;
-  await apiPOST("/broadcast-peer",{message:msg});
+  await sendCommand("broadcast-peer",{message:msg});
   addNotification("Broadcast sent");
 }
 
 function openChannel(name){
   currentChat = { type:"channel", name };
+  channelCursor = { name, last: null, loading: false };
   q("#chatWindow").innerHTML =
   `<div class="d-flex align-items-center justify-content-between mb-3">
       <div class="d-flex align-items-center gap-2">
@@ -455,27 +478,132 @@ async function sendMessage(){
     win.appendChild(wrapper);
     win.scrollTop = win.scrollHeight;
 
-    await apiPOST("/send-peer",{ip:currentChat.ip,port:currentChat.port,message:msg});
+    await sendCommand("send-peer",{ip:currentChat.ip,port:currentChat.port,message:msg});
   } 
   else if(currentChat.type==="channel"){
     if(!myId) await fetchMyId();
-    await apiPOST("http://127.0.0.1:9000/post-channel", {
+    await apiPOST(TRACKER_URL + "/post-channel", {
       name: currentChat.name,
       sender: myId || "me",
       msg: msg
     });
+    loadChannelMessages(currentChat.name);
   }
   q("#messageInput").value="";
 }
 
 async function loadChannelMessages(name){
-  let r = await apiPOST("http://127.0.0.1:9000/channel-history", {name});
+  if(channelCursor.name !== name) channelCursor = { name, last: null, loading: false };
+  if(channelCursor.loading) return;
+  channelCursor.loading = true;
+
+  // first load: newest page; afterwards only messages after the cursor
+  let query = channelCursor.last === null
+    ? { name, limit: CHANNEL_PAGE }
+    : { name, since: channelCursor.last };
+  let r = await apiPOST(TRACKER_URL + "/channel-history", query);
+  channelCursor.loading = false;
+  if(!Array.isArray(r)) return;
+  appendChannelMessages(name, r, query.since === undefined);
+}
+
+function appendChannelMessages(name, r, scroll){
+  if(channelCursor.name !== name) return;
   let win = q("#chatWindow");
-  win.innerHTML="";
-  (r||[]).forEach(m=>{
-    win.innerHTML += `<div><small>${escapeHtml(m.sender)}</small>: ${escapeHtml(m.msg)}</div>`;
+  let atBottom = win.scrollHeight - win.scrollTop - win.clientHeight < 40;
+  r.forEach(m=>{
+    if(channelCursor.last !== null && m.id <= channelCursor.last) return;
+    let div = document.createElement("div");
+    div.innerHTML = `<small>${escapeHtml(m.sender)}</small>: ${escapeHtml(m.msg)}`;
+    win.appendChild(div);
+    channelCursor.last = m.id;
   });
-  win.scrollTop = win.scrollHeight;
+  if(r.length && (atBottom || scroll)) win.scrollTop = win.scrollHeight;
+}
+
+function onChannelPost(m){
+  if(!currentChat || currentChat.type !== "channel" || currentChat.name !== m.name) return;
+  if(channelCursor.last === null) return;        // first page still loading
+  if(m.id === channelCursor.last + 1) appendChannelMessages(m.name, [m]);
+  else loadChannelMessages(m.name);              // missed some: fetch the gap
+}
+
+function isChatWithPeers(){
+  return !currentChat || currentChat.type !== "channel";
+}
+
+// Run a chat app POST route over the WebSocket when it is open, so sending
+// does not cost a request; falls back to HTTP.
+function sendCommand(action, body){
+  if(localSocket && localSocket.readyState === WebSocket.OPEN){
+    localSocket.send(JSON.stringify(Object.assign({action}, body)));
+    return Promise.resolve({status:"queued"});
+  }
+  return apiPOST("/" + action, body);
+}
+
+function resyncLocal(){
+  refreshPending();
+  refreshConnected();
+  if(isChatWithPeers()) refreshMessages();
+}
+
+function onLocalEvent(event, data){
+  if(event === "message"){
+    messageLog.push(data);
+    if(isChatWithPeers()) renderMessages();
+  } else if(event === "pending"){
+    renderPending(data);
+  } else if(event === "connected"){
+    renderConnected(data);
+  } else if(event === "broadcast"){
+    let missed = Object.keys(data.peers).filter(p=>data.peers[p] !== "delivered");
+    if(missed.length) addNotification(`Broadcast not delivered to ${missed.join(", ")}`);
+  }
+}
+
+// One full-duplex connection per tab to the chat app: events in, commands
+// out. Reconnects after a drop and resyncs the full state on every open.
+function connectLocalSocket(){
+  let proto = location.protocol === "https:" ? "wss://" : "ws://";
+  let ws = new WebSocket(proto + location.host + "/ws");
+  ws.onopen = ()=>{ localSocket = ws; resyncLocal(); };
+  ws.onmessage = e=>{
+    let m = JSON.parse(e.data);
+    if(m.event) onLocalEvent(m.event, m.data);
+  };
+  ws.onclose = ()=>{
+    if(localSocket === ws) localSocket = null;
+    setTimeout(connectLocalSocket, 3000);
+  };
+}
+
+// Server push: the chat app streams P2P messages, pending requests and
+// connected peers; the tracker streams online peers and channel activity.
+// EventSource reconnects by itself; each (re)connect resyncs the full state.
+function subscribeEvents(){
+  if(!window.EventSource && !window.WebSocket) return false;
+
+  if(window.WebSocket){
+    connectLocalSocket();
+  } else {
+    let local = new EventSource("/events");
+    local.addEventListener("open", resyncLocal);
+    ["message", "pending", "connected", "broadcast"].forEach(name=>
+      local.addEventListener(name, e=>onLocalEvent(name, JSON.parse(e.data))));
+  }
+  if(!window.EventSource) return false;   // poll the tracker instead
+
+  let tracker = new EventSource(TRACKER_URL + "/events");
+  tracker.addEventListener("open", ()=>{
+    refreshOnlinePeers();
+    refreshChannels();
+    if(!isChatWithPeers()) loadChannelMessages(currentChat.name);
+  });
+  tracker.addEventListener("peers", e=>renderOnlinePeers(JSON.parse(e.data)));
+  tracker.addEventListener("channels", ()=>refreshChannels());
+  tracker.addEventListener("channel", e=>onChannelPost(JSON.parse(e.data)));
+  return true;
 }
 
 q("#btnRefresh").addEventListener("click",()=>refreshAll());
@@ -491,7 +619,7 @@ document.addEventListener("DOMContentLoaded", ()=>{
       ev.preventDefault(); // avoid form auto-submit if inside a form
       const name = (input.value || "").trim();
       if(!name) { addNotification("Channel name empty"); return; }
-      let resp = await apiPOST("http://127.0.0.1:9000/create-channel", { name });
+      let resp = await apiPOST(TRACKER_URL + "/create-channel", { name });
       if(resp && (resp.status === "ok" || resp.status === "created")){
         addNotification("Channel created: " + name);
         input.value = ""; // clear after success
@@ -505,9 +633,6 @@ document.addEventListener("DOMContentLoaded", ()=>{
 
 
 function refreshAll(){
-  if(currentChat && currentChat.type==="channel"){
-    loadChannelMessages(currentChat.name);
-  }
   refreshOnlinePeers();
   refreshPending();
   refreshConnected();
@@ -521,5 +646,5 @@ function refreshAll(){
 
 fetchMyId().then(()=>{
   refreshAll();
-  setInterval(refreshAll,REFRESH_INTERVAL);
+  if(!subscribeEvents()) setInterval(refreshAll,REFRESH_INTERVAL);
 });